@@ -0,0 +1,78 @@
+"""
+Benchmark data for the Promotion Service
+
+Fills the promotion table with fake Promotions from
+tests.factories.PromotionFactory so that every benchmark runs against the
+same kind of data. On PostgreSQL large tables are loaded with COPY, which
+writes millions of rows in seconds.
+"""
+import io
+import logging
+import itertools
+from service.models import Promotion, as_datetime, db
+from tests.factories import PromotionFactory
+
+logger = logging.getLogger("flask.app")
+
+
+def reset():
+    """Drops and recreates the promotion table"""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    Promotion.invalidate_all()
+    Promotion.invalidate_intervals()
+
+
+def fake_promotions(count):
+    """Returns count unsaved Promotions with datetime start and end dates"""
+    promotions = PromotionFactory.build_batch(count)
+    for promotion in promotions:
+        promotion.id = None
+        promotion.start_date = as_datetime(promotion.start_date)
+        promotion.end_date = as_datetime(promotion.end_date)
+    return promotions
+
+
+def seed(count, batch_size=5000):
+    """Adds count fake Promotions to the table and returns their ids"""
+    if db.engine.dialect.name == "postgresql" and count > batch_size:
+        return seed_copy(count)
+    ids = []
+    for start in range(0, count, batch_size):
+        ids.extend(Promotion.create_many(fake_promotions(min(batch_size, count - start)), batch_size))
+    logger.info("Seeded %s promotions", count)
+    return ids
+
+
+def seed_copy(count, batch_size=100000, templates=1000):
+    """Adds count fake Promotions with PostgreSQL COPY and returns their ids
+
+    Rows cycle through ``templates`` Promotions built by the factory and
+    are streamed to the server ``batch_size`` at a time.
+    """
+    columns = ("title", "promotion_type", "start_date", "end_date", "active")
+    lines = itertools.cycle([
+        "\t".join((
+            promotion.title, promotion.promotion_type,
+            promotion.start_date.isoformat(), promotion.end_date.isoformat(),
+            "t" if promotion.active else "f",
+        )) + "\n"
+        for promotion in fake_promotions(templates)
+    ])
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT coalesce(max(id), 0) FROM promotion")
+        first_id = cursor.fetchone()[0] + 1
+        for start in range(0, count, batch_size):
+            rows = "".join(itertools.islice(lines, min(batch_size, count - start)))
+            cursor.copy_from(io.StringIO(rows), "promotion", columns=columns)
+        cursor.execute("SELECT id FROM promotion WHERE id >= %s ORDER BY id", (first_id,))
+        ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("ANALYZE promotion")
+        connection.commit()
+    finally:
+        connection.close()
+    logger.info("Copied %s promotions", count)
+    return ids
@@ -0,0 +1,196 @@
+"""
+Microbenchmarks for the Promotion Service hot paths
+
+Times the model and route helpers that every request goes through and the
+finders at several table sizes. Results are written as JSON and can be
+compared against a stored baseline to catch regressions:
+
+    python -m benchmarks.hotpaths --output baseline.json
+    python -m benchmarks.hotpaths --compare baseline.json
+
+The database is sqlite (a temporary file) unless --database is given, for
+example --database postgresql://postgres@localhost:5432/benchdb. The
+promotion table of that database is dropped and refilled.
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import logging
+import argparse
+import itertools
+import platform
+import statistics
+import tempfile
+from datetime import datetime, timezone
+
+from service import app
+from service.models import Promotion, db
+from service.routes import api, promotion_args, promotion_model, serializer
+from benchmarks.data import fake_promotions, reset, seed
+
+DEFAULT_SIZES = "1000,100000"
+DEFAULT_THRESHOLD = 0.2
+
+
+def measure(func, repeat=5, budget=0.2):
+    """Times func and returns the median and fastest time per call
+
+    The number of calls per timing is picked so that each one lasts about
+    ``budget`` seconds, then the timing is repeated ``repeat`` times.
+    """
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * budget / max(elapsed, 1e-9)))
+    per_call = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "median_us": round(statistics.median(per_call) * 1e6, 2),
+        "min_us": round(min(per_call) * 1e6, 2),
+        "calls": number * repeat,
+    }
+
+
+def model_benchmarks():
+    """Benchmarks that do not touch the database"""
+    promotion = fake_promotions(1)[0]
+    promotion.id = 1
+    data = promotion.serialize()
+
+    @api.marshal_with(promotion_model)
+    def marshalled():
+        return promotion.serialize()
+
+    results = {
+        "serialize": measure(promotion.serialize),
+        "deserialize": measure(lambda: Promotion().deserialize(data)),
+        "serializer.one": measure(lambda: serializer.one(promotion)),
+    }
+    # marshal_with and the parsers read the request being answered
+    query_string = "/promotions?active=true&title=Summer%20Sale&limit=100&fields=id,title"
+    with app.test_request_context(query_string):
+        results["marshal_with"] = measure(marshalled)
+        results["promotion_args.parse_args"] = measure(promotion_args.parse_args)
+    return results
+
+
+def finder_benchmarks(size, ids):
+    """Benchmarks of the finders on a table of size rows
+
+    Every lookup by id runs in a fresh session, as it would in a request,
+    so that it is not answered from the session's identity map.
+    """
+    sample = fake_promotions(1)[0]
+    lookups = itertools.cycle(ids)
+
+    def find():
+        Promotion.find(next(lookups))
+        db.session.remove()
+
+    finders = {
+        "find": find,
+        "find_by_title": lambda: Promotion.find_by_title(sample.title).all(),
+        "find_by_promotiontype": lambda: Promotion.find_by_promotiontype(sample.promotion_type).all(),
+        "find_by_active": lambda: Promotion.find_by_active(True).all(),
+        "find_by_end_date": lambda: Promotion.find_by_end_date(sample.end_date).all(),
+        "search": lambda: Promotion.search(sample.title[:-2]),
+    }
+    results = {}
+    for name, finder in finders.items():
+        # listings of large tables are slow, so time fewer of them
+        results["{}[{}]".format(name, size)] = measure(
+            finder, repeat=3 if size > 10000 and name != "find" else 5
+        )
+        db.session.remove()
+    return results
+
+
+def run(database, sizes):
+    """Runs every benchmark and returns the results"""
+    app.config["SQLALCHEMY_DATABASE_URI"] = database
+    Promotion.init_db(app)
+    results = model_benchmarks()
+    reset()
+    seeded, ids = 0, []
+    for size in sorted(sizes):
+        logging.getLogger("flask.app").info("Seeding %s promotions", size)
+        ids.extend(seed(size - seeded))
+        seeded = size
+        results.update(finder_benchmarks(size, ids[:1000]))
+    reset()
+    return {
+        "meta": {
+            "database": db.engine.dialect.name,
+            "python": platform.python_version(),
+            "sizes": sorted(sizes),
+            "created": datetime.now(timezone.utc).isoformat(),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Prints each benchmark next to its baseline and returns the regressions
+
+    A benchmark regressed when its median is more than ``threshold``
+    (a fraction) slower than in the baseline.
+    """
+    regressions = []
+    print("{:<36} {:>12} {:>12} {:>8}".format("benchmark", "baseline us", "current us", "change"))
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print("{:<36} {:>12} {:>12.2f} {:>8}".format(name, "-", result["median_us"], "new"))
+            continue
+        change = result["median_us"] / before["median_us"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("{:<36} {:>12.2f} {:>12.2f} {:>+7.0%}{}".format(
+            name, before["median_us"], result["median_us"], change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database", help="database URI, defaults to a temporary sqlite file")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="comma separated table sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with this baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown, as a fraction, reported as a regression")
+    args = parser.parse_args(argv)
+
+    app.logger.setLevel(logging.WARNING)
+    workdir = None
+    database = args.database
+    if database is None:
+        workdir = tempfile.mkdtemp(prefix="promotions-benchmark-")
+        database = "sqlite:///" + os.path.join(workdir, "benchmark.db")
+    started = time.perf_counter()
+    current = run(database, [int(size) for size in args.sizes.split(",")])
+    current["meta"]["seconds"] = round(time.perf_counter() - started, 1)
+    if workdir is not None:
+        db.engine.dispose()
+        os.remove(os.path.join(workdir, "benchmark.db"))
+        os.rmdir(workdir)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(current, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print("{} regression(s) over {:.0%}".format(len(regressions), args.threshold))
+            return 1
+    else:
+        print(json.dumps(current, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
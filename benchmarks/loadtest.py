@@ -0,0 +1,302 @@
+"""
+HTTP load test for the Promotion Service
+
+Starts the service under gunicorn, exactly as the Procfile does and with
+the settings of gunicorn.conf.py, against a local database. It then drives
+a weighted mix of requests from concurrent keep-alive clients and reports
+the throughput and the p50/p95/p99/max latency of every endpoint:
+
+    python -m benchmarks.loadtest --database postgresql://postgres@localhost:5432/loaddb \\
+        --seed 1000000 --clients 32 --duration 30 --mix list=2,get=6,create=1,update=1,activate=1
+
+The GUNICORN_* and DB_POOL_* environment variables are passed on to the
+server, so concurrency models can be compared. Use --url to load an
+already running server instead of starting one.
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import logging
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+
+from service import app
+from service.models import Promotion
+from benchmarks.data import fake_promotions, seed
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = "list=2,get=6,create=1,update=1,activate=1"
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+######################################################################
+#  R E Q U E S T   M I X
+######################################################################
+
+
+def promotion_body():
+    """Returns the JSON body of a fake Promotion"""
+    promotion = fake_promotions(1)[0]
+    return json.dumps({
+        "title": promotion.title,
+        "promotion_type": promotion.promotion_type,
+        "start_date": promotion.start_date.isoformat(),
+        "end_date": promotion.end_date.isoformat(),
+        "active": promotion.active,
+    })
+
+
+def list_request(ids):
+    return "GET", "/promotions?limit=20&active=true", None, None
+
+
+def get_request(ids):
+    return "GET", "/promotions/{}".format(random.choice(ids)), None, None
+
+
+def create_request(ids):
+    return "POST", "/promotions", promotion_body(), JSON_HEADERS
+
+
+def update_request(ids):
+    return "PUT", "/promotions/{}".format(random.choice(ids)), promotion_body(), JSON_HEADERS
+
+
+def activate_request(ids):
+    return "PUT", "/promotions/{}/activate".format(random.choice(ids)), None, None
+
+
+REQUESTS = {
+    "list": list_request,
+    "get": get_request,
+    "create": create_request,
+    "update": update_request,
+    "activate": activate_request,
+}
+
+
+def parse_mix(mix):
+    """Parses name=weight pairs into (names, weights)"""
+    names, weights = [], []
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in REQUESTS:
+            raise ValueError("Unknown request {}, expected one of {}".format(name, ", ".join(REQUESTS)))
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+######################################################################
+#  S E R V E R
+######################################################################
+
+
+def start_server(database, port):
+    """Starts gunicorn like the Procfile does and waits until it answers"""
+    env = dict(os.environ, DATABASE_URI=database, PORT=str(port), PYTHONPATH=REPO_DIR)
+    server = subprocess.Popen(
+        ["gunicorn", "--log-level=warning", "--bind=127.0.0.1:{}".format(port), "service:app"],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited with status {}".format(server.returncode))
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/promotions?limit=1")
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.25)
+    stop_server(server)
+    raise RuntimeError("gunicorn did not answer within 60 seconds")
+
+
+def stop_server(server):
+    """Stops gunicorn gracefully"""
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def prepare_database(database, count):
+    """Upgrades the schema and adds count fake Promotions"""
+    app.config["SQLALCHEMY_DATABASE_URI"] = database
+    Promotion.init_db(app)
+    Promotion.migrate_db()
+    if count:
+        print("Seeding {} promotions...".format(count), file=sys.stderr)
+        started = time.perf_counter()
+        seed(count)
+        print("Seeded in {:.1f}s".format(time.perf_counter() - started), file=sys.stderr)
+    Promotion.dispose_engine()
+
+
+def fetch_ids(host, port):
+    """Returns up to 1000 ids of existing Promotions"""
+    connection = http.client.HTTPConnection(host, port)
+    connection.request("GET", "/promotions?fields=id&limit=1000")
+    ids = [promotion["id"] for promotion in json.loads(connection.getresponse().read())]
+    if not ids:
+        raise RuntimeError("There are no promotions to load, use --seed")
+    return ids
+
+
+######################################################################
+#  L O A D
+######################################################################
+
+
+class Client(threading.Thread):
+    """A keep-alive client that sends requests from the mix until told to stop"""
+
+    def __init__(self, host, port, ids, mix, stop):
+        super().__init__(daemon=True)
+        self.host, self.port = host, port
+        self.ids = ids
+        self.names, self.weights = mix
+        self.stop = stop
+        self.latencies = {name: [] for name in self.names}
+        self.errors = {name: 0 for name in self.names}
+
+    def run(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        while not self.stop.is_set():
+            name = random.choices(self.names, self.weights)[0]
+            method, path, body, headers = REQUESTS[name](self.ids)
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body, headers or {})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    self.errors[name] += 1
+            except (OSError, http.client.HTTPException):
+                self.errors[name] += 1
+                connection.close()
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+                continue
+            self.latencies[name].append(time.perf_counter() - started)
+        connection.close()
+
+
+def percentile(ordered, fraction):
+    """Returns the nearest rank percentile of an ordered list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def summarize(latencies, errors, duration):
+    """Returns throughput and latency percentiles in milliseconds"""
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / duration, 1),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+def run_load(host, port, mix, clients, duration, warmup):
+    """Runs the clients for duration seconds, after warmup seconds, and
+    returns the results per endpoint and for all of them"""
+    ids = fetch_ids(host, port)
+    stop = threading.Event()
+    threads = [Client(host, port, ids, mix, stop) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    for thread in threads:
+        for name in thread.latencies:
+            thread.latencies[name] = []
+            thread.errors[name] = 0
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    endpoints = {}
+    every = []
+    for name in mix[0]:
+        latencies = [value for thread in threads for value in thread.latencies[name]]
+        every.extend(latencies)
+        errors = sum(thread.errors[name] for thread in threads)
+        endpoints[name] = summarize(latencies, errors, duration)
+    total = summarize(every, sum(e["errors"] for e in endpoints.values()), duration)
+    return {"total": total, "endpoints": endpoints}
+
+
+def print_report(report):
+    """Prints the results as a table"""
+    print("{:<10} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+        "endpoint", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    rows = list(report["endpoints"].items()) + [("total", report["total"])]
+    for name, result in rows:
+        print("{:<10} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+            name, result["requests"], result["errors"], result["rps"], result["p50_ms"],
+            result["p95_ms"], result["p99_ms"], result["max_ms"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database", default=os.getenv("DATABASE_URI"),
+                        help="database the started server uses, defaults to DATABASE_URI")
+    parser.add_argument("--url", help="load this running server instead of starting one")
+    parser.add_argument("--port", type=int, default=5099, help="port of the started server")
+    parser.add_argument("--seed", type=int, default=0, help="fake promotions to add first")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted requests, name=weight,...")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to measure")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds to run before measuring")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+    app.logger.setLevel(logging.WARNING)
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+        if args.seed:
+            parser.error("--seed needs --database and is not used with --url")
+    else:
+        if not args.database:
+            parser.error("--database or DATABASE_URI is required to start the server")
+        prepare_database(args.database, args.seed)
+        host, port = "127.0.0.1", args.port
+        server = start_server(args.database, port)
+    try:
+        report = run_load(host, port, mix, args.clients, args.duration, args.warmup)
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    report["settings"] = {
+        "mix": args.mix,
+        "clients": args.clients,
+        "duration": args.duration,
+        "gunicorn": {name: value for name, value in os.environ.items() if name.startswith("GUNICORN_")},
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Startup benchmark for the Promotion Service
+
+Measures, in fresh interpreters, how long ``import service`` takes and how
+long it takes from a cold start until the first request has been answered.
+Run it from the repository root:
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+
+The first request is ``GET /promotions?limit=1`` against DATABASE_URI, so
+it includes opening the first database connection.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# runs in a child interpreter so that nothing is imported beforehand
+PROBE = """
+import json, time
+started = time.perf_counter()
+import service
+imported = time.perf_counter()
+response = service.app.test_client().get("/promotions?limit=1")
+answered = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "first_request": answered - started,
+    "status": response.status_code,
+}))
+"""
+
+
+def probe(env):
+    """Starts one interpreter and returns its timings"""
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], env=env, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    ).stdout
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def summarize(samples):
+    """Returns the median, minimum and maximum of some timings in milliseconds"""
+    return {
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "min_ms": round(min(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10, help="number of cold starts")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("PYTHONPATH", os.getcwd())
+    runs = [probe(env) for _ in range(args.runs)]
+    results = {
+        "runs": args.runs,
+        "import": summarize([run["import"] for run in runs]),
+        "first_request": summarize([run["first_request"] for run in runs]),
+        "statuses": sorted({run["status"] for run in runs}),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
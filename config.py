@@ -19,5 +19,101 @@ if 'VCAP_SERVICES' in os.environ:
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker. Workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# must stay below the database's max_connections, so by default the workers
+# share DB_MAX_CONNECTIONS, which leaves PostgreSQL's default of 100 room for
+# migrations and admin sessions. Within its share a worker keeps at least
+# one connection per gunicorn thread. gunicorn.conf.py exports the worker
+# and thread counts. Checkouts that wait more than DB_POOL_SLOW_CHECKOUT
+# seconds for a connection are logged.
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "90"))
+DB_WORKER_CONNECTIONS = max(1, DB_MAX_CONNECTIONS // int(os.getenv("GUNICORN_WORKERS", "1")))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", min(
+    max(5, int(os.getenv("GUNICORN_THREADS", "1"))), DB_WORKER_CONNECTIONS
+)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", max(0, min(10, DB_WORKER_CONNECTIONS - DB_POOL_SIZE))))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+DB_POOL_SLOW_CHECKOUT = float(os.getenv("DB_POOL_SLOW_CHECKOUT", "0.1"))
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# Number of rows fetched per database round trip when streaming listings
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# /promotions/export reads and encodes EXPORT_BATCH_SIZE rows at a time and
+# compresses with zlib level EXPORT_GZIP_LEVEL, 1 (fastest) to 9 (smallest)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "1"))
+
+# Number of promotions inserted per statement by POST /promotions/bulk
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+# Read-through LRU cache in front of single promotion lookups. Each worker
+# has its own cache, so another worker's writes can be seen up to
+# PROMOTION_CACHE_TTL seconds late.
+PROMOTION_CACHE_ENABLED = os.getenv("PROMOTION_CACHE_ENABLED", "false").lower() in ("true", "1", "yes")
+PROMOTION_CACHE_SIZE = int(os.getenv("PROMOTION_CACHE_SIZE", "1024"))
+PROMOTION_CACHE_TTL = float(os.getenv("PROMOTION_CACHE_TTL", "30"))
+
+# Seconds before the in-memory index behind /promotions/effective is rebuilt
+# from the database to pick up writes made by other workers
+EFFECTIVE_INDEX_TTL = float(os.getenv("EFFECTIVE_INDEX_TTL", "60"))
+
+# With SCHEDULER_ENABLED every gunicorn worker runs the promotion scheduler,
+# which activates and expires the Promotions as their dates pass, every
+# SCHEDULER_INTERVAL seconds in UPDATEs of SCHEDULER_BATCH_SIZE rows. An
+# advisory lock lets one worker at a time run it. It can also run on its own
+# with `python -m service.scheduler`.
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "false").lower() in ("true", "1", "yes")
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", "60"))
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "1000"))
+
+# /promotions/search returns the Promotions whose title or type words are
+# at least SEARCH_SIMILARITY_THRESHOLD similar to the query, 0 to 1. Without
+# pg_trgm an in-memory index is used, rebuilt every SEARCH_INDEX_TTL seconds
+# to pick up writes made by other workers.
+SEARCH_SIMILARITY_THRESHOLD = float(os.getenv("SEARCH_SIMILARITY_THRESHOLD", "0.6"))
+SEARCH_INDEX_TTL = float(os.getenv("SEARCH_INDEX_TTL", "60"))
+
+# Counts requested with total=estimate use the query planner's estimate
+# instead of COUNT(*) when it expects at least this many rows
+COUNT_ESTIMATE_THRESHOLD = int(os.getenv("COUNT_ESTIMATE_THRESHOLD", "100000"))
+
+# Record request, database and pool metrics and serve them at /metrics.
+# Under gunicorn they are shared between the workers through the files in
+# PROMETHEUS_MULTIPROC_DIR, see gunicorn.conf.py
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("true", "1", "yes")
+
+# SQL statements slower than SLOW_QUERY_THRESHOLD seconds are logged with
+# their route and parameters, and one statement repeated N_PLUS_ONE_THRESHOLD
+# times in a request is logged as a possible N+1. Responses carry the
+# statement count and database time in a Server-Timing header. With
+# QUERY_BUDGET_STRICT a view that runs more statements than its
+# query_budget raises an error instead of logging a warning.
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.2"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("true", "1", "yes")
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "false").lower() in ("true", "1", "yes")
+
+# Log records are written by a background thread from a queue of
+# LOG_QUEUE_SIZE records. Once it is half full only one in LOG_SAMPLE_RATE
+# info records is kept, and near full only warnings and errors are. A size
+# of 0 makes the queue unbounded and keeps every record. Set LOG_FORMAT to
+# "json" for one JSON object per line instead of text.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE", "10"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# JSON encoder used to write responses: "json", "orjson" or "auto" to use
+# orjson when it is installed
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto")
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
@@ -1,6 +1,100 @@
 import os
+import sys
+import glob
+import shutil
+import tempfile
+import multiprocessing
 
 PORT = os.getenv("PORT", "5000")
 bind = "0.0.0.0:" + PORT
-workers = 1
-log_level = "info"
\ No newline at end of file
+log_level = "info"
+
+# Concurrency model, chosen with GUNICORN_WORKER_CLASS:
+#   sync    - one request at a time per worker process
+#   gthread - GUNICORN_THREADS requests at a time per worker, one thread each
+#   gevent  - cooperative greenlets, GUNICORN_WORKER_CONNECTIONS per worker
+#             (needs gevent and psycogreen)
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "1" if worker_class == "sync" else "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+# config.py splits DB_MAX_CONNECTIONS between the workers and sizes each
+# pool for its threads, the workers inherit these
+os.environ["GUNICORN_WORKERS"] = str(workers)
+os.environ["GUNICORN_THREADS"] = str(threads)
+
+# The workers write their metrics to files in this directory so that
+# /metrics can add them up. It must be set before prometheus_client is
+# imported, so it is set here rather than in a hook.
+metrics_dir_created = not os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if metrics_dir_created:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="promotions-metrics-")
+# imported up front, importing it in child_exit breaks when workers exit together
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def on_starting(server):
+    """Brings the schema up to date once, before any worker starts
+
+    Only when DB_AUTO_MIGRATE is set, otherwise run `flask db upgrade` as a
+    separate release step. Metrics left by a previous run are removed first.
+    """
+    for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+        os.remove(path)
+    if os.getenv("DB_AUTO_MIGRATE", "false").lower() in ("true", "1", "yes"):
+        from service.models import Promotion
+        Promotion.migrate_db()
+
+
+def post_fork(server, worker):
+    """Drops database connections the worker inherited from the master
+
+    This only matters with --preload or DB_AUTO_MIGRATE, when the app and
+    its engine are created before the fork; otherwise each worker builds
+    its own.
+    """
+    if worker_class == "gevent":
+        # psycopg2 blocks in C, make it yield to the gevent hub instead
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    service = sys.modules.get("service")
+    if service is not None:
+        # the log listener thread stayed behind in the master
+        if hasattr(service, "log_queue"):
+            service.log_queue.restart()
+        with service.app.app_context():
+            service.models.Promotion.dispose_engine()
+
+
+def post_worker_init(worker):
+    """Starts the promotion scheduler once the worker has loaded the app
+
+    Only when SCHEDULER_ENABLED is set. Every worker runs one and an
+    advisory lock decides which of them runs at each interval, so the
+    scheduler keeps running when a worker dies.
+    """
+    if os.getenv("SCHEDULER_ENABLED", "false").lower() in ("true", "1", "yes"):
+        from service import scheduler
+        worker.scheduler = scheduler.from_config()
+        worker.scheduler.start()
+
+
+def worker_exit(server, worker):
+    """Stops the scheduler and writes out the log records still queued by the worker"""
+    if getattr(worker, "scheduler", None) is not None:
+        worker.scheduler.stop(timeout=5)
+    service = sys.modules.get("service")
+    if service is not None and hasattr(service, "log_queue"):
+        service.log_queue.stop()
+
+
+def child_exit(server, worker):
+    """Stops counting the in flight requests and pool gauges of a dead worker"""
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    """Removes the metrics directory when it was made for this run"""
+    if metrics_dir_created:
+        shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
@@ -0,0 +1,38 @@
+"""create promotion table
+
+Revision ID: 3f2a1c9d8b7e
+Revises: 
+Create Date: 2026-10-17 09:12:41.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a1c9d8b7e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases deployed before migrations were introduced already have the
+    # table from db.create_all(), so only create it when it is missing.
+    inspector = sa.inspect(op.get_bind())
+    if 'promotion' in inspector.get_table_names():
+        return
+    op.create_table(
+        'promotion',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=63), nullable=False),
+        sa.Column('promotion_type', sa.String(length=63), nullable=False),
+        sa.Column('start_date', sa.DateTime(), nullable=False),
+        sa.Column('end_date', sa.DateTime(), nullable=False),
+        sa.Column('active', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('promotion')
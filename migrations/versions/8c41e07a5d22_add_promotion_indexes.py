@@ -0,0 +1,42 @@
+"""add promotion indexes
+
+Revision ID: 8c41e07a5d22
+Revises: 3f2a1c9d8b7e
+Create Date: 2026-10-17 09:30:05.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41e07a5d22'
+down_revision = '3f2a1c9d8b7e'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_promotion_title', ['title']),
+    ('ix_promotion_promotion_type', ['promotion_type']),
+    ('ix_promotion_end_date', ['end_date', 'id']),
+    ('ix_promotion_active_end_date', ['active', 'end_date']),
+    ('ix_promotion_start_date_end_date', ['start_date', 'end_date']),
+]
+
+
+def upgrade():
+    # On PostgreSQL build the indexes CONCURRENTLY so that the existing
+    # production table is not locked against writes while they are built.
+    # That cannot run inside a transaction, hence the autocommit block.
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, columns in INDEXES:
+                op.create_index(name, 'promotion', columns, postgresql_concurrently=True)
+    else:
+        for name, columns in INDEXES:
+            op.create_index(name, 'promotion', columns)
+
+
+def downgrade():
+    for name, _ in reversed(INDEXES):
+        op.drop_index(name, table_name='promotion')
@@ -0,0 +1,27 @@
+"""add promotion version and updated_at
+
+Revision ID: b7d93e4f0a16
+Revises: 8c41e07a5d22
+Create Date: 2026-10-17 11:02:47.530129
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d93e4f0a16'
+down_revision = '8c41e07a5d22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # server defaults fill in the existing rows
+    op.add_column('promotion', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('promotion', sa.Column('updated_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=False))
+
+
+def downgrade():
+    op.drop_column('promotion', 'updated_at')
+    op.drop_column('promotion', 'version')
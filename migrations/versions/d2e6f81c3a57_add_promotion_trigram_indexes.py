@@ -0,0 +1,55 @@
+"""add promotion trigram indexes
+
+Revision ID: d2e6f81c3a57
+Revises: b7d93e4f0a16
+Create Date: 2026-10-17 16:12:41.803529
+
+"""
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2e6f81c3a57'
+down_revision = 'b7d93e4f0a16'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic')
+
+INDEXES = [
+    ('ix_promotion_title_trgm', 'title'),
+    ('ix_promotion_promotion_type_trgm', 'promotion_type'),
+]
+
+
+def upgrade():
+    # Only PostgreSQL with the pg_trgm contrib module can index text by
+    # trigrams. Without it /promotions/search uses the in-memory index.
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    available = bind.execute(
+        sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    ).scalar()
+    if not available:
+        logger.warning('pg_trgm is not available, skipping the trigram indexes')
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # GiST rather than GIN indexes since they can also return the rows
+    # nearest to the query first, ORDER BY q <<-> title LIMIT k, without
+    # scoring every match. Built CONCURRENTLY like the other indexes.
+    with op.get_context().autocommit_block():
+        for name, column in INDEXES:
+            op.create_index(
+                name, 'promotion', [column], postgresql_using='gist',
+                postgresql_ops={column: 'gist_trgm_ops'}, postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, _ in reversed(INDEXES):
+        op.execute('DROP INDEX IF EXISTS {}'.format(name))
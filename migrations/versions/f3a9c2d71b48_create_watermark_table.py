@@ -0,0 +1,30 @@
+"""create watermark table
+
+Revision ID: f3a9c2d71b48
+Revises: d2e6f81c3a57
+Create Date: 2026-10-17 18:40:09.261744
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c2d71b48'
+down_revision = 'd2e6f81c3a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # one row per background job, the moment it has processed up to
+    op.create_table(
+        'watermark',
+        sa.Column('name', sa.String(length=63), nullable=False),
+        sa.Column('value', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('watermark')
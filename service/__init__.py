@@ -2,43 +2,54 @@
 Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
-and SQL database
+and SQL database. The database is only connected to on first use and the
+schema is managed separately with ``flask db upgrade``.
 """
 import os
-import sys
 import logging
 from flask import Flask
+from service import logqueue
 
 # Create Flask application
 app = Flask(__name__)
 app.config.from_object("config")
 
 # Import the rutes After the Flask app is created
-from service import routes, models, error_handlers
+from service import routes, models, error_handlers, queries, metrics
 
 # Set up logging for production
 if __name__ != "__main__":
     gunicorn_logger = logging.getLogger("gunicorn.error")
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
-    app.logger.propagate = False
+    # the models and helpers log to flask.app, the routes to app.logger
+    loggers = [app.logger, logging.getLogger("flask.app")]
+    for logger in loggers:
+        logger.setLevel(gunicorn_logger.level)
+        logger.propagate = False
     # Make all log formats consistent
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
-    )
-    for handler in app.logger.handlers:
+    if app.config["LOG_FORMAT"] == "json":
+        formatter = logqueue.JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
+        )
+    for handler in gunicorn_logger.handlers:
         handler.setFormatter(formatter)
+    # write from a background thread so that requests never wait on log I/O
+    log_queue = logqueue.QueueLogging(
+        loggers, gunicorn_logger.handlers,
+        maxsize=app.config["LOG_QUEUE_SIZE"], sample_rate=app.config["LOG_SAMPLE_RATE"],
+    )
+    log_queue.start()
     app.logger.info("Logging handler established")
 
 app.logger.info(70 * "*")
 app.logger.info("  P R O M O T I O N   S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
 
-try:
-    routes.init_db()  # make our sqlalchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+routes.init_db()  # configure sqlalchemy, connecting lazily
+
+# only the flask command line needs the migrations
+if os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+    models.init_migrations(app)
 
 app.logger.info("Service inititalized!")
@@ -0,0 +1,250 @@
+"""
+Promotion Service, ASGI entry point
+
+Serves the core /promotions API with async handlers on top of
+AsyncPromotion, so one process can keep thousands of requests in flight
+while they wait on PostgreSQL. Run it with:
+
+    uvicorn service.asgi:app
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn service.asgi:app
+
+Paths:
+------
+GET /promotions - Returns the Promotions, filtered by title, promotion_type and active and paged with limit and cursor
+GET /promotions/{id} - Returns the Promotion with a given id number
+POST /promotions - creates a new Promotion record in the database
+PUT /promotions/{id} - updates a Promotion record in the database, honouring If-Match
+DELETE /promotions/{id} - deletes a Promotion record in the database
+PUT /promotions/{id}/activate - activates a Promotion with a given id number
+PUT /promotions/{id}/deactivate - deactivates a Promotion with a given id number
+"""
+import json
+import logging
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.exceptions import HTTPException as WerkzeugHTTPException
+from werkzeug.http import parse_etags, quote_etag
+from service import app as flask_app, status
+from service.models import Promotion, DataValidationError
+from service.async_models import AsyncPromotion
+from service.routes import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, serializer, promotion_etag, etag_version,
+    encode_cursor, decode_cursor,
+)
+
+logger = logging.getLogger("flask.app")
+
+JSON_MIMETYPE = "application/json"
+# promotion.id is a PostgreSQL integer, asyncpg rejects larger ids
+MAX_PROMOTION_ID = 2 ** 31 - 1
+
+
+######################################################################
+# U T I L I T Y   F U N C T I O N S
+######################################################################
+
+
+def promotion_response(promotion, status_code=status.HTTP_200_OK, headers=None):
+    """ Returns a Promotion as JSON with its ETag """
+    headers = dict(headers or {}, ETag=quote_etag(promotion_etag(promotion)))
+    return Response(serializer.one(promotion), status_code, headers, media_type=JSON_MIMETYPE)
+
+
+def promotion_id_or_404(request):
+    """ Returns the promotion id of the path, a non numeric id or one outside
+    the integer column is never found """
+    promotion_id = request.path_params["promotion_id"]
+    if not promotion_id.isdigit() or int(promotion_id) > MAX_PROMOTION_ID:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Promotion with id '{}' was not found.".format(promotion_id))
+    return int(promotion_id)
+
+
+async def promotion_payload(request):
+    """ Returns the posted Promotion, checking the content type and the body """
+    if request.headers.get("content-type", "").split(";")[0] != JSON_MIMETYPE:
+        raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Content-Type must be {}".format(JSON_MIMETYPE))
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "The body is not valid JSON")
+    return Promotion().deserialize(data)
+
+
+def list_args(request):
+    """ Parses the filters and paging arguments of the listing """
+    args = request.query_params
+    filters = {"title": args.get("title"), "promotion_type": args.get("promotion_type"), "active": None}
+    if "active" in args:
+        if args["active"].lower() not in ("true", "false", "1", "0"):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "active must be a boolean")
+        filters["active"] = args["active"].lower() in ("true", "1")
+    limit, after = None, None
+    if "limit" in args:
+        if not args["limit"].isdigit() or not 1 <= int(args["limit"]) <= MAX_PAGE_SIZE:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "limit must be between 1 and {}".format(MAX_PAGE_SIZE))
+        limit = int(args["limit"])
+    if "cursor" in args:
+        try:
+            sort, key = decode_cursor(args["cursor"])
+        except WerkzeugHTTPException:
+            sort = None
+        if sort != "id":
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+        after = key[0]
+    return filters, limit, after
+
+
+######################################################################
+# PATH: /promotions
+######################################################################
+
+
+async def list_promotions(request):
+    """ Returns the Promotions, one page at a time when limit or cursor is given """
+    filters, limit, after = list_args(request)
+    logger.info("Request for promotion list filtered by %s", filters)
+    headers = {}
+    if limit is None and after is None:
+        promotions = await AsyncPromotion.find_by_filters(**filters)
+    else:
+        limit = limit or DEFAULT_PAGE_SIZE
+        # read one extra row to learn whether there is a next page
+        promotions = await AsyncPromotion.find_by_filters(after=after, limit=limit + 1, **filters)
+        if len(promotions) > limit:
+            promotions = promotions[:limit]
+            headers["X-Next-Cursor"] = encode_cursor("id", (promotions[-1].id,))
+    logger.info("[%s] Promotions returned", len(promotions))
+    return Response(serializer.many(promotions), status.HTTP_200_OK, headers, media_type=JSON_MIMETYPE)
+
+
+async def create_promotion(request):
+    """ Creates a Promotion from the posted JSON """
+    logger.info("Request to create a promotion")
+    promotion = await AsyncPromotion.create(await promotion_payload(request))
+    logger.info("Promotion with new id [%s] created!", promotion.id)
+    location = str(request.url_for("promotion", promotion_id=promotion.id))
+    return promotion_response(promotion, status.HTTP_201_CREATED, {"Location": location})
+
+
+######################################################################
+# PATH: /promotions/{id}
+######################################################################
+
+
+async def get_promotion(request):
+    """ Returns a single Promotion, or 304 when If-None-Match has its ETag """
+    promotion_id = promotion_id_or_404(request)
+    logger.info("Request for promotion with id: [%s]", promotion_id)
+    promotion = await AsyncPromotion.find(promotion_id)
+    if promotion is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Promotion with id '{}' was not found.".format(promotion_id))
+    etag = promotion_etag(promotion)
+    if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": quote_etag(etag)})
+    return promotion_response(promotion)
+
+
+async def update_promotion(request):
+    """ Replaces a Promotion, only at the version in If-Match when one is given """
+    promotion_id = promotion_id_or_404(request)
+    logger.info("Request to update promotion with id: %s", promotion_id)
+    promotion = await promotion_payload(request)
+    version = None
+    if_match = parse_etags(request.headers.get("if-match"))
+    if request.headers.get("if-match") and not if_match.star_tag:
+        version = etag_version(if_match, promotion_id)
+        if version is None:
+            raise HTTPException(status.HTTP_412_PRECONDITION_FAILED, "If-Match does not name this promotion")
+    updated = await AsyncPromotion.update(promotion_id, promotion, version)
+    if updated is None:
+        if version is not None and await AsyncPromotion.find(promotion_id) is not None:
+            raise HTTPException(status.HTTP_412_PRECONDITION_FAILED, "Promotion has been modified")
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Promotion with id '{}' was not found.".format(promotion_id))
+    return promotion_response(updated)
+
+
+async def delete_promotion(request):
+    """ Deletes a Promotion, deleting one that does not exist is not an error """
+    promotion_id = promotion_id_or_404(request)
+    logger.info("Request to delete promotion with id: %s", promotion_id)
+    await AsyncPromotion.delete(promotion_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def activate_promotion(request):
+    """ Activates a Promotion """
+    return await set_active(request, True)
+
+
+async def deactivate_promotion(request):
+    """ Deactivates a Promotion """
+    return await set_active(request, False)
+
+
+async def set_active(request, active):
+    """ Sets the active flag of a Promotion, or answers 404 """
+    promotion_id = promotion_id_or_404(request)
+    promotion = await AsyncPromotion.set_active(promotion_id, active)
+    if promotion is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Promotion with id '{}' was not found.".format(promotion_id))
+    return promotion_response(promotion)
+
+
+######################################################################
+# E R R O R   H A N D L E R S
+######################################################################
+
+
+async def http_error(request, error):
+    """ Answers HTTP errors with the same JSON body as the Flask app """
+    return JSONResponse(
+        {"status": error.status_code, "error": error.detail, "message": error.detail},
+        status_code=error.status_code,
+    )
+
+
+async def validation_error(request, error):
+    """ Handles bad data in a posted Promotion """
+    return JSONResponse(
+        {"status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": str(error)},
+        status_code=status.HTTP_400_BAD_REQUEST,
+    )
+
+
+######################################################################
+# A P P L I C A T I O N
+######################################################################
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    """ Holds the database pool open, with the Flask app's settings, while serving """
+    config = flask_app.config
+    await AsyncPromotion.init_pool(
+        config["DATABASE_URI"],
+        min_size=config["DB_POOL_SIZE"],
+        max_size=config["DB_POOL_SIZE"] + config["DB_MAX_OVERFLOW"],
+        timeout=config["DB_POOL_TIMEOUT"],
+    )
+    try:
+        yield
+    finally:
+        await AsyncPromotion.close_pool()
+
+
+app = Starlette(
+    routes=[
+        Route("/promotions", list_promotions, methods=["GET"]),
+        Route("/promotions", create_promotion, methods=["POST"]),
+        Route("/promotions/{promotion_id}", get_promotion, methods=["GET"], name="promotion"),
+        Route("/promotions/{promotion_id}", update_promotion, methods=["PUT"]),
+        Route("/promotions/{promotion_id}", delete_promotion, methods=["DELETE"]),
+        Route("/promotions/{promotion_id}/activate", activate_promotion, methods=["PUT"]),
+        Route("/promotions/{promotion_id}/deactivate", deactivate_promotion, methods=["PUT"]),
+    ],
+    exception_handlers={HTTPException: http_error, DataValidationError: validation_error},
+    lifespan=lifespan,
+)
@@ -0,0 +1,155 @@
+"""
+Async data access for the Promotion Service
+
+AsyncPromotion mirrors the Promotion finders and writers on top of an
+asyncpg connection pool so that the ASGI app in service/asgi.py never
+blocks its event loop on the database. It reads and writes the same
+``promotion`` table, returns the same Promotion objects (detached from any
+session) and bumps the row version the same way, so ETags agree between
+the two entry points.
+"""
+import logging
+import asyncpg
+from service.models import Promotion, DataValidationError, as_datetime
+
+logger = logging.getLogger("flask.app")
+
+COLUMNS = "id, title, promotion_type, start_date, end_date, active, version, updated_at"
+
+
+class AsyncPromotion:
+    """
+    Async counterpart of the Promotion class methods
+
+    ``init_pool`` must be awaited once before any other method, usually
+    from the ASGI lifespan startup, and ``close_pool`` on shutdown.
+    """
+
+    pool = None
+
+    @classmethod
+    async def init_pool(cls, dsn, min_size=5, max_size=15, timeout=30.0):
+        """Opens the connection pool
+
+        Args:
+            dsn (string): a postgres:// or postgresql:// database URI
+            min_size (int): the connections kept open
+            max_size (int): the most connections opened under load
+            timeout (float): seconds to wait for a connection
+        """
+        logger.info("Opening async database pool (%s-%s connections)", min_size, max_size)
+        cls.pool = await asyncpg.create_pool(
+            dsn, min_size=min_size, max_size=max_size, timeout=timeout, command_timeout=timeout
+        )
+
+    @classmethod
+    async def close_pool(cls):
+        """Closes every connection of the pool"""
+        if cls.pool is not None:
+            await cls.pool.close()
+            cls.pool = None
+
+    @staticmethod
+    def _to_promotion(record):
+        return Promotion(**dict(record)) if record is not None else None
+
+    @staticmethod
+    def _values(promotion):
+        """Returns the validated column values of a deserialized Promotion"""
+        row = promotion.to_row()
+        for name in ("start_date", "end_date"):
+            row[name] = as_datetime(row[name])
+            if row[name] is None:
+                raise DataValidationError("Invalid promotion: bad " + name)
+        if not isinstance(row["title"], str) or not isinstance(row["promotion_type"], str):
+            raise DataValidationError("Invalid promotion: title and promotion_type must be strings")
+        return row
+
+    @classmethod
+    async def all(cls):
+        """ Returns all of the Promotions in the database """
+        logger.info("Processing all Promotions")
+        records = await cls.pool.fetch("SELECT {} FROM promotion ORDER BY id".format(COLUMNS))
+        return [cls._to_promotion(record) for record in records]
+
+    @classmethod
+    async def find_by_filters(cls, title=None, promotion_type=None, active=None, after=None, limit=None):
+        """Returns the matching Promotions in id order
+
+        Args:
+            title, promotion_type, active: filters that are ignored when None
+            after (int): only return Promotions with a higher id
+            limit (int): the maximum number of Promotions, or None for all
+        """
+        logger.info("Processing query title=%s promotion_type=%s active=%s after=%s limit=%s",
+                    title, promotion_type, active, after, limit)
+        records = await cls.pool.fetch(
+            "SELECT {} FROM promotion"
+            " WHERE id > $1"
+            " AND ($2::varchar IS NULL OR title = $2)"
+            " AND ($3::varchar IS NULL OR promotion_type = $3)"
+            " AND ($4::boolean IS NULL OR active = $4)"
+            " ORDER BY id LIMIT $5".format(COLUMNS),
+            after or 0, title, promotion_type, active, limit,
+        )
+        return [cls._to_promotion(record) for record in records]
+
+    @classmethod
+    async def find(cls, promotion_id):
+        """ Finds a Promotion by it's ID, or returns None """
+        logger.info("Processing lookup for id %s ...", promotion_id)
+        record = await cls.pool.fetchrow(
+            "SELECT {} FROM promotion WHERE id = $1".format(COLUMNS), promotion_id
+        )
+        return cls._to_promotion(record)
+
+    @classmethod
+    async def create(cls, promotion):
+        """Inserts a deserialized Promotion and returns it as stored"""
+        logger.info("Creating %s", promotion.title)
+        row = cls._values(promotion)
+        record = await cls.pool.fetchrow(
+            "INSERT INTO promotion (title, promotion_type, start_date, end_date, active, updated_at)"
+            " VALUES ($1, $2, $3, $4, $5, now() at time zone 'utc') RETURNING {}".format(COLUMNS),
+            row["title"], row["promotion_type"], row["start_date"], row["end_date"], row["active"],
+        )
+        return cls._to_promotion(record)
+
+    @classmethod
+    async def update(cls, promotion_id, promotion, version=None):
+        """Replaces the columns of a Promotion and bumps its version
+
+        When ``version`` is given the row is only updated if it still has
+        that version. Returns the updated Promotion, or None when there is
+        no such row (or it has another version).
+        """
+        logger.info("Updating %s", promotion.title)
+        row = cls._values(promotion)
+        record = await cls.pool.fetchrow(
+            "UPDATE promotion SET title = $2, promotion_type = $3, start_date = $4,"
+            " end_date = $5, active = $6, version = version + 1, updated_at = now() at time zone 'utc'"
+            " WHERE id = $1 AND ($7::integer IS NULL OR version = $7)"
+            " RETURNING {}".format(COLUMNS),
+            promotion_id, row["title"], row["promotion_type"], row["start_date"],
+            row["end_date"], row["active"], version,
+        )
+        return cls._to_promotion(record)
+
+    @classmethod
+    async def set_active(cls, promotion_id, active):
+        """Sets the active flag of a Promotion in one statement and returns it"""
+        logger.info("Setting active=%s on id %s", active, promotion_id)
+        record = await cls.pool.fetchrow(
+            "UPDATE promotion SET active = $2, version = version + 1,"
+            " updated_at = now() at time zone 'utc'"
+            " WHERE id = $1 RETURNING {}".format(COLUMNS),
+            promotion_id, active,
+        )
+        return cls._to_promotion(record)
+
+    @classmethod
+    async def delete(cls, promotion_id):
+        """Deletes a Promotion and returns True if there was one"""
+        logger.info("Deleting id %s", promotion_id)
+        result = await cls.pool.execute("DELETE FROM promotion WHERE id = $1", promotion_id)
+        return result != "DELETE 0"
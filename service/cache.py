@@ -0,0 +1,82 @@
+"""
+In-process cache for the Promotion Service
+
+LRUCache - a bounded, thread safe least recently used cache whose entries
+expire after a time to live. It is used to keep hot Promotions out of the
+database on single id lookups.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Bounded least recently used cache with a time to live
+
+    Every entry expires ``ttl`` seconds after it was stored. When the cache
+    is full the least recently used entry is evicted to make room.
+    Hits, misses and evictions are counted so that the hit ratio can be
+    reported.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30.0, clock=time.monotonic):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Returns the value stored for key, or None when missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Stores value under key, evicting the least recently used entry when full"""
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Removes key from the cache if it is there"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Returns the size of the cache and its hit, miss and eviction counts"""
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
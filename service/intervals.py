@@ -0,0 +1,174 @@
+"""
+Interval index for the Promotion Service
+
+IntervalTree - a centered interval tree over closed [start, end] intervals
+that answers "which intervals contain this point" and "which intervals
+overlap this window" in O(log n + k). It is built balanced from a batch of
+intervals and then kept up to date with incremental adds and removals.
+"""
+from bisect import bisect_left, insort
+
+
+class _Node:
+    """ A tree node holding every interval that contains its center """
+
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, center):
+        self.center = center
+        self.by_start = []  # sorted (start, key, end)
+        self.by_end = []  # sorted (end, key, start)
+        self.left = None
+        self.right = None
+
+    def add(self, key, start, end):
+        insort(self.by_start, (start, key, end))
+        insort(self.by_end, (end, key, start))
+
+    def remove(self, key, start, end):
+        del self.by_start[bisect_left(self.by_start, (start, key, end))]
+        del self.by_end[bisect_left(self.by_end, (end, key, start))]
+
+
+def _midpoint(start, end):
+    """ Returns the point half way between start and end (numbers or datetimes) """
+    return start + (end - start) / 2
+
+
+class IntervalTree:
+    """
+    Centered interval tree keyed by a unique id
+
+    Every interval is stored in the highest node whose center it contains,
+    in two lists sorted by start and by end. A point query walks a single
+    root to leaf path and, at each node, scans only the intervals that
+    match, so it costs O(depth + k).
+    """
+
+    def __init__(self, intervals=None):
+        self._root = None
+        self._intervals = {}  # key -> (start, end)
+        if intervals:
+            self._build(list(intervals))
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __contains__(self, key):
+        return key in self._intervals
+
+    def _build(self, intervals):
+        """ Builds a balanced tree from (key, start, end) tuples """
+        for key, start, end in intervals:
+            if start > end:
+                raise ValueError("Interval {} starts after it ends".format(key))
+            self._intervals[key] = (start, end)
+        self._root = self._build_node(intervals)
+
+    def _build_node(self, intervals):
+        if not intervals:
+            return None
+        points = sorted(point for _, start, end in intervals for point in (start, end))
+        node = _Node(points[len(points) // 2])
+        left, right = [], []
+        for key, start, end in intervals:
+            if end < node.center:
+                left.append((key, start, end))
+            elif start > node.center:
+                right.append((key, start, end))
+            else:
+                node.by_start.append((start, key, end))
+                node.by_end.append((end, key, start))
+        node.by_start.sort()
+        node.by_end.sort()
+        node.left = self._build_node(left)
+        node.right = self._build_node(right)
+        return node
+
+    def add(self, key, start, end):
+        """ Adds the interval [start, end], replacing any interval with the same key """
+        if start > end:
+            raise ValueError("Interval {} starts after it ends".format(key))
+        if key in self._intervals:
+            self.remove(key)
+        self._intervals[key] = (start, end)
+        if self._root is None:
+            self._root = _Node(_midpoint(start, end))
+        node = self._root
+        while True:
+            if end < node.center:
+                if node.left is None:
+                    node.left = _Node(_midpoint(start, end))
+                node = node.left
+            elif start > node.center:
+                if node.right is None:
+                    node.right = _Node(_midpoint(start, end))
+                node = node.right
+            else:
+                node.add(key, start, end)
+                return
+
+    def remove(self, key):
+        """ Removes the interval with the given key if there is one """
+        if key not in self._intervals:
+            return
+        start, end = self._intervals.pop(key)
+        node = self._root
+        while node is not None:
+            if end < node.center:
+                node = node.left
+            elif start > node.center:
+                node = node.right
+            else:
+                node.remove(key, start, end)
+                return
+
+    def at(self, point):
+        """ Returns the keys of every interval that contains point """
+        keys = []
+        node = self._root
+        while node is not None:
+            if point < node.center:
+                for start, key, _ in node.by_start:
+                    if start > point:
+                        break
+                    keys.append(key)
+                node = node.left
+            elif point > node.center:
+                for end, key, _ in reversed(node.by_end):
+                    if end < point:
+                        break
+                    keys.append(key)
+                node = node.right
+            else:
+                keys.extend(key for _, key, _ in node.by_start)
+                break
+        return keys
+
+    def overlapping(self, low, high):
+        """ Returns the keys of every interval that overlaps [low, high] """
+        if low > high:
+            raise ValueError("The window starts after it ends")
+        keys = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if high < node.center:
+                for start, key, _ in node.by_start:
+                    if start > high:
+                        break
+                    keys.append(key)
+                stack.append(node.left)
+            elif low > node.center:
+                for end, key, _ in reversed(node.by_end):
+                    if end < low:
+                        break
+                    keys.append(key)
+                stack.append(node.right)
+            else:
+                keys.extend(key for _, key, _ in node.by_start)
+                stack.append(node.left)
+                stack.append(node.right)
+        return keys
@@ -0,0 +1,150 @@
+"""
+Non-blocking logging for the Promotion Service
+
+Log records are put on a bounded queue by the thread that logs them and
+written out by a QueueListener thread, so a request never waits on stdout
+or on a file. When the queue fills up, records are shed instead of
+blocking:
+
+* above half full only one in ``sample_rate`` INFO and DEBUG records is
+  kept
+* above ``info_limit`` (nine tenths of the queue) INFO and DEBUG records
+  are dropped, keeping the rest of the room for warnings and errors
+* when the queue is full every record is dropped
+
+The number of shed records is logged as a warning once there is room.
+
+QueueLogging - the queue, its handler and the listener of one process
+JsonFormatter - writes each record as one line of JSON
+"""
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler that sheds records instead of blocking on a full queue
+    """
+
+    def __init__(self, log_queue, sample_rate=10):
+        super().__init__(log_queue)
+        self.sample_rate = max(1, sample_rate)
+        self.sample_limit = log_queue.maxsize // 2
+        self.info_limit = log_queue.maxsize * 9 // 10
+        self._lock = threading.Lock()
+        self._sampled = 0
+        self.dropped = 0
+        self.dropped_total = 0
+
+    def _keep(self, record):
+        """Returns whether a record fits under the shedding policy"""
+        if record.levelno >= logging.WARNING or self.queue.maxsize <= 0:
+            # an unbounded queue never fills up, so nothing is shed
+            return True
+        size = self.queue.qsize()
+        if size >= self.info_limit:
+            return False
+        if size >= self.sample_limit:
+            with self._lock:
+                self._sampled += 1
+                return self._sampled % self.sample_rate == 0
+        return True
+
+    def enqueue(self, record):
+        if not self._keep(record):
+            self._drop()
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._drop()
+            return
+        if self.dropped:
+            self._report_dropped(record)
+
+    def _drop(self):
+        with self._lock:
+            self.dropped += 1
+            self.dropped_total += 1
+
+    def _report_dropped(self, record):
+        """Queues a warning with the number of records shed since the last one"""
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if not dropped:
+            return
+        warning = logging.LogRecord(
+            record.name, logging.WARNING, record.pathname, record.lineno,
+            "Log queue full, %s log records were dropped", (dropped,), None,
+        )
+        try:
+            self.queue.put_nowait(self.prepare(warning))
+        except queue.Full:
+            with self._lock:
+                self.dropped += dropped
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON objects, one per line"""
+
+    def format(self, record):
+        document = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+class QueueLogging:
+    """
+    Puts a bounded queue between some loggers and their handlers
+
+    ``start()`` gives the loggers a BoundedQueueHandler as their only
+    handler and starts a listener thread that passes the records on to
+    ``handlers``. Threads do not survive a fork, so a forked process must call
+    ``restart()`` to get a listener of its own.
+    """
+
+    def __init__(self, loggers, handlers, maxsize=10000, sample_rate=10):
+        self.loggers = list(loggers)
+        self.handlers = list(handlers)
+        self.maxsize = maxsize
+        self.sample_rate = sample_rate
+        self.handler = None
+        self.listener = None
+
+    def start(self):
+        """Puts the queue in front of the handlers and starts the listener"""
+        log_queue = queue.Queue(self.maxsize)
+        self.handler = BoundedQueueHandler(log_queue, self.sample_rate)
+        self.listener = QueueListener(log_queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        for logger in self.loggers:
+            logger.handlers = [self.handler]
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Writes out the queued records and stops the listener"""
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+    def restart(self):
+        """Starts over with an empty queue, after a fork"""
+        atexit.unregister(self.stop)
+        self.listener._thread = None
+        self.start()
+
+    def stats(self):
+        """Returns the records waiting in the queue and the records dropped"""
+        return {"queued": self.handler.queue.qsize(), "dropped": self.handler.dropped_total}
@@ -0,0 +1,184 @@
+######################################################################
+# Prometheus Metrics
+######################################################################
+"""
+Request, database, connection pool and scheduler metrics served at GET /metrics
+
+Every gunicorn worker keeps its own metrics. When PROMETHEUS_MULTIPROC_DIR
+names a directory (gunicorn.conf.py sets one up) each worker writes its
+values to memory mapped files in it and /metrics adds up the files of all
+the workers, so whichever worker answers the scrape reports the totals of
+the whole service. Without it, /metrics reports the current process only.
+"""
+import os
+import time
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+from prometheus_client import multiprocess
+from service.models import Promotion
+from service.pool import TimedQueuePool
+from . import app
+
+# Seconds, from a cached lookup to a large unpaged listing
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes, from a single promotion to a full page of a thousand
+SIZE_BUCKETS = (100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+HTTP_REQUESTS = Counter(
+    "promotions_http_requests_total", "HTTP requests answered",
+    ["method", "route", "status"],
+)
+HTTP_LATENCY = Histogram(
+    "promotions_http_request_duration_seconds", "Time to answer an HTTP request",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "promotions_http_requests_in_flight", "HTTP requests being answered",
+    multiprocess_mode="livesum",
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "promotions_http_response_size_bytes", "Size of the HTTP response bodies, streamed ones excluded",
+    ["method", "route"], buckets=SIZE_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    "promotions_db_queries_per_request", "Database statements run by an HTTP request",
+    ["method", "route"], buckets=QUERY_COUNT_BUCKETS,
+)
+DB_TIME = Histogram(
+    "promotions_db_query_duration_seconds_per_request", "Time an HTTP request spent in database statements",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "promotions_db_pool_checked_out", "Database connections in use",
+    multiprocess_mode="livesum",
+)
+DB_POOL_SIZE = Gauge(
+    "promotions_db_pool_size", "Database connections kept open by the pools",
+    multiprocess_mode="livesum",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "promotions_db_pool_overflow", "Database connections opened above the pool size",
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAIT = Histogram(
+    "promotions_db_pool_wait_seconds", "Time spent waiting for a database connection",
+    buckets=LATENCY_BUCKETS,
+)
+SCHEDULER_RUNS = Counter(
+    "promotions_scheduler_runs_total", "Runs of the promotion scheduler by result",
+    ["result"],
+)
+SCHEDULER_PROMOTIONS = Counter(
+    "promotions_scheduler_promotions_total", "Promotions activated or expired by the scheduler",
+    ["action"],
+)
+SCHEDULER_DURATION = Histogram(
+    "promotions_scheduler_run_duration_seconds", "Time a scheduler run took",
+    buckets=LATENCY_BUCKETS,
+)
+SCHEDULER_WATERMARK = Gauge(
+    "promotions_scheduler_watermark_timestamp_seconds", "The moment the scheduler has processed the dates up to",
+    multiprocess_mode="max",
+)
+
+TimedQueuePool.wait_listener = DB_POOL_WAIT.observe
+
+# labelled histograms of each (method, route), looked up once
+route_series = {}
+
+
+######################################################################
+# U T I L I T Y   F U N C T I O N S
+######################################################################
+
+
+def metrics_registry():
+    """ Returns the registry of every worker, or of this process only """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def route_label():
+    """ Returns the URL rule of the request, so ids do not make new series """
+    if request.url_rule is None:
+        return "unmatched"
+    return request.url_rule.rule
+
+
+def series_for(method, route):
+    """ Returns the latency, size, query and database time histograms of a route """
+    key = (method, route)
+    series = route_series.get(key)
+    if series is None:
+        series = route_series[key] = tuple(
+            metric.labels(method, route) for metric in (HTTP_LATENCY, HTTP_RESPONSE_SIZE, DB_QUERIES, DB_TIME)
+        )
+    return series
+
+
+def update_pool_gauges():
+    """ Copies the connection pool usage of this process into the gauges """
+    stats = Promotion.pool_stats()
+    if "checked_out" in stats:
+        DB_POOL_CHECKED_OUT.set(stats["checked_out"])
+        DB_POOL_SIZE.set(stats["size"])
+        DB_POOL_OVERFLOW.set(max(stats["overflow"], 0))
+
+
+######################################################################
+# R E Q U E S T   H O O K S
+######################################################################
+
+
+@app.before_request
+def start_request_timer():
+    """ Starts timing the request and counting its statements """
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_request(response):
+    """ Records the answered request, streamed ones up to their headers """
+    if "metrics_started" not in g:
+        return response
+    method, route = request.method, route_label()
+    latency, size, queries, db_time = series_for(method, route)
+    HTTP_REQUESTS.labels(method, route, response.status_code).inc()
+    latency.observe(time.perf_counter() - g.metrics_started)
+    if response.content_length is not None:
+        size.observe(response.content_length)
+    sql = g.get("sql")
+    if sql is not None:
+        queries.observe(sql.count)
+        db_time.observe(sql.seconds)
+    update_pool_gauges()
+    return response
+
+
+@app.teardown_request
+def end_request(error=None):
+    """ Takes the request out of the in flight count, even when it failed """
+    if "metrics_started" in g:
+        HTTP_IN_FLIGHT.dec()
+        del g.metrics_started
+
+
+######################################################################
+# GET /metrics
+######################################################################
+
+
+@app.route("/metrics")
+def metrics():
+    """ Returns the metrics of the service in the Prometheus text format """
+    update_pool_gauges()
+    return Response(generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -9,25 +9,69 @@ Attributes
 -----------
 """
 
+import os
+import json
+import time
 import logging
+import operator
+import threading
 from enum import Enum
+from datetime import date, datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from service.cache import LRUCache
+from service.intervals import IntervalTree
+from service.pool import TimedQueuePool
+from service.search import NgramIndex
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.sql.operators import in_op
+from sqlalchemy import and_, or_, func, inspect, literal, select, tuple_, union_all
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# Alembic migrations that create and evolve the schema, see migrations/
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
 
 def init_db(app):
     """Initialies the SQLAlchemy app"""
     Promotion.init_db(app)
 
 
+def init_migrations(app):
+    """Registers Flask-Migrate so that ``flask db`` can manage the schema
+
+    Alembic is slow to import and only the command line needs it, so it is
+    imported here instead of when the service starts.
+    """
+    from flask_migrate import Migrate
+    Migrate(app, db, directory=MIGRATIONS_DIR)
+
+
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+def as_datetime(value):
+    """Converts a date, an ISO 8601 string or an aware datetime to the naive
+    UTC datetime stored in the database, or None when it cannot be converted"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return None
+
+
 
 class Promotion(db.Model):
     """
@@ -38,16 +82,75 @@ class Promotion(db.Model):
 
     app = None
 
+    # read-through cache of single id lookups, see init_db()
+    cache = None
+
+    # interval tree over (start_date, end_date) built on first use, see
+    # interval_index(), and when it was built. While a thread rebuilds it the
+    # changes made meanwhile are kept in intervals_pending, None once they
+    # cannot be replayed and the new tree must be thrown away.
+    intervals = None
+    intervals_built_at = 0.0
+    intervals_building = False
+    intervals_pending = None
+    intervals_lock = threading.RLock()
+
+    # trigram index over the titles and types used by search() when the
+    # database has no pg_trgm, see ngram_index(), and when it was built
+    ngrams = None
+    ngrams_built_at = 0.0
+    ngrams_lock = threading.RLock()
+    # whether the pg_trgm extension is installed, checked on first search
+    trigram_search = None
+
+    # Column tuples that the collection can be paged by. The primary key is
+    # always last so that every key is unique.
+    SORT_KEYS = {
+        "id": ("id",),
+        "end_date": ("end_date", "id"),
+    }
+
+    # Filters accepted by find_by_filters() as (column, comparison) pairs.
+    # active_on is special cased since it compares against two columns.
+    FILTERS = {
+        "ids": ("id", in_op),
+        "title": ("title", operator.eq),
+        "promotion_type": ("promotion_type", operator.eq),
+        "active": ("active", operator.eq),
+        "start_date": ("start_date", operator.eq),
+        "start_date_lt": ("start_date", operator.lt),
+        "start_date_gte": ("start_date", operator.ge),
+        "end_date": ("end_date", operator.eq),
+        "end_date_lt": ("end_date", operator.lt),
+        "end_date_gte": ("end_date", operator.ge),
+        "active_on": None,
+    }
+
     ##################################################
     # Table Schema
     ##################################################
 
     id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(63), nullable=False)
-    promotion_type = db.Column(db.String(63), nullable=False)
+    title = db.Column(db.String(63), nullable=False, index=True)
+    promotion_type = db.Column(db.String(63), nullable=False, index=True)
     start_date = db.Column(db.DateTime(), nullable=False)
     end_date = db.Column(db.DateTime(), nullable=False)
     active = db.Column(db.Boolean(), nullable=False, default=False)
+    # bumped on every UPDATE, used for ETags and optimistic concurrency
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    updated_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=func.current_timestamp())
+
+    __mapper_args__ = {"version_id_col": version}
+
+    # Indexes must be added through a new revision in migrations/ as well
+    __table_args__ = (
+        # end_date lookups and keyset pages sorted by (end_date, id)
+        db.Index("ix_promotion_end_date", "end_date", "id"),
+        db.Index("ix_promotion_active_end_date", "active", "end_date"),
+        # date window lookups such as active_on
+        db.Index("ix_promotion_start_date_end_date", "start_date", "end_date"),
+    )
 
     def __repr__(self):
         return "<Promotion %r id=[%s]>" % (self.title, self.id)
@@ -58,21 +161,54 @@ class Promotion(db.Model):
         """
         logger.info("Creating %s", self.title)
         self.id = None  # id must be none to generate next primary key
+        start_date, end_date = self.start_date, self.end_date
         db.session.add(self)
         db.session.commit()
+        self.invalidate(self.identity())
+        self.index_dates(self.identity(), start_date, end_date)
+        self.index_text(self.identity(), self.title, self.promotion_type)
 
     def delete(self):
         """Removes a Pet from the data store"""
         logger.info("Deleting %s", self.title)
         db.session.delete(self)
         db.session.commit()
+        self.invalidate(self.identity())
+        self.unindex_dates(self.identity())
+        self.unindex_text(self.identity())
 
     def update(self):
         """
         Updates a Promotion to the database
         """
         logger.info("Updating %s", self.title)
+        start_date, end_date = self.start_date, self.end_date
+        title, promotion_type = self.title, self.promotion_type
         db.session.commit()
+        self.invalidate(self.identity())
+        self.index_dates(self.identity(), start_date, end_date)
+        self.index_text(self.identity(), title, promotion_type)
+
+    def identity(self):
+        """Returns the primary key this Promotion was stored with, without
+        reloading it from the database after a commit"""
+        key = inspect(self).identity
+        return key[0] if key else None
+
+    def to_cache(self):
+        """Returns every column value, used to rebuild this Promotion from the cache"""
+        return dict(self.to_row(), id=self.id, active=self.active,
+                    version=self.version, updated_at=self.updated_at)
+
+    def to_row(self):
+        """Returns the column values used to insert this Promotion"""
+        return {
+            "title": self.title,
+            "promotion_type": self.promotion_type,
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "active": self.active,
+        }
 
     def serialize(self):
         """Serializes a Promotion into a dictionary"""
@@ -98,6 +234,10 @@ class Promotion(db.Model):
             self.promotion_type = data["promotion_type"]
             self.start_date = data["start_date"]
             self.end_date = data["end_date"]
+            if not isinstance(data["active"], bool):
+                raise DataValidationError(
+                    "Invalid type for boolean [active]: " + str(type(data["active"]))
+                )
             self.active = data["active"]
         except KeyError as error:
             raise DataValidationError(
@@ -120,10 +260,112 @@ class Promotion(db.Model):
         """
         logger.info("Initializing database")
         cls.app = app
-        # This is where we initialize SQLAlchemy from the Flask app
+        cls.cache = None
+        cls.invalidate_intervals()
+        cls.invalidate_search()
+        cls.trigram_search = None
+        if app.config.get("PROMOTION_CACHE_ENABLED"):
+            cls.cache = LRUCache(
+                app.config.get("PROMOTION_CACHE_SIZE", 1024),
+                app.config.get("PROMOTION_CACHE_TTL", 30.0),
+            )
+        options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+        if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+            # SQLite keeps its own pool which takes no sizing options
+            for name in ("pool_size", "max_overflow", "pool_timeout", "poolclass", "slow_checkout"):
+                options.pop(name, None)
+        else:
+            options.setdefault("poolclass", TimedQueuePool)
+            options.setdefault("slow_checkout", app.config.get("DB_POOL_SLOW_CHECKOUT", 0.1))
+        # This is where we initialize SQLAlchemy from the Flask app. The
+        # engine and its first connection are only created when first used.
         db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+
+    @classmethod
+    def migrate_db(cls):
+        """Brings the tables up to the latest migration, see migrations/"""
+        from flask_migrate import Migrate, upgrade
+        logger.info("Upgrading the database schema")
+        Migrate(cls.app, db, directory=MIGRATIONS_DIR)
+        upgrade(directory=MIGRATIONS_DIR)
+
+    @classmethod
+    def dispose_engine(cls):
+        """Closes every pooled connection so that a forked worker opens its own
+
+        Connections made before a fork share their sockets with the parent
+        process and must not be used by the child.
+        """
+        logger.info("Disposing of the database engine in process %s", os.getpid())
+        db.engine.dispose()
+
+    @classmethod
+    def pool_stats(cls):
+        """Returns the connection pool usage and checkout wait times"""
+        pool = db.engine.pool
+        if isinstance(pool, TimedQueuePool):
+            return pool.stats()
+        return {"status": pool.status()}
+
+    @classmethod
+    def create_many(cls, promotions, batch_size=1000):
+        """Creates many Promotions with one multi-row INSERT per batch
+
+        Every batch is inserted and committed in one round trip. When a batch
+        is rejected by the database its rows are retried one at a time so
+        that only the offending Promotions fail.
+
+        Args:
+            promotions (list): the deserialized Promotions to create
+            batch_size (int): the number of rows per INSERT statement
+
+        Returns:
+            a list with, for each Promotion in order, either its new id or the
+            DataValidationError that kept it from being created
+        """
+        logger.info("Creating %s Promotions in batches of %s",
+                    len(promotions), batch_size)
+        results = []
+        for start in range(0, len(promotions), batch_size):
+            rows = [promotion.to_row() for promotion in promotions[start:start + batch_size]]
+            try:
+                ids = cls._insert_rows(rows)
+                db.session.commit()
+                results.extend(ids)
+                for promotion_id, row in zip(ids, rows):
+                    cls.index_dates(promotion_id, row["start_date"], row["end_date"])
+                    cls.index_text(promotion_id, row["title"], row["promotion_type"])
+            except SQLAlchemyError as error:
+                db.session.rollback()
+                logger.warning("Batch insert failed, retrying rows one by one: %s", error)
+                for row in rows:
+                    try:
+                        ids = cls._insert_rows([row])
+                        db.session.commit()
+                        results.extend(ids)
+                        cls.index_dates(ids[0], row["start_date"], row["end_date"])
+                        cls.index_text(ids[0], row["title"], row["promotion_type"])
+                    except SQLAlchemyError as row_error:
+                        db.session.rollback()
+                        message = str(getattr(row_error, "orig", row_error)).splitlines()[0]
+                        results.append(DataValidationError("Invalid promotion: " + message))
+        return results
+
+    @classmethod
+    def _insert_rows(cls, rows):
+        """Inserts rows in the current transaction and returns their ids"""
+        table = cls.__table__
+        if db.engine.dialect.name == "postgresql":
+            # a single INSERT ... VALUES (...), (...) RETURNING id
+            result = db.session.execute(table.insert().values(rows).returning(table.c.id))
+            return [row[0] for row in result]
+        # backends without RETURNING insert one row per statement
+        return [
+            db.session.execute(table.insert(), row).inserted_primary_key[0]
+            for row in rows
+        ]
 
     @classmethod
     def all(cls):
@@ -131,15 +373,421 @@ class Promotion(db.Model):
         logger.info("Processing all Promotions")
         return cls.query.all()
 
+    @classmethod
+    def find_page(cls, limit, after=None, sort="id", query=None):
+        """Returns one page of Promotions using keyset (seek) pagination
+
+        Rows are read with ``WHERE key > :after ORDER BY key LIMIT :n`` so
+        every page costs the same no matter how deep into the table it is,
+        unlike OFFSET which has to walk over all of the skipped rows.
+
+        Args:
+            limit (int): the maximum number of Promotions to return
+            after (tuple): the sort key of the last row of the previous page
+            sort (string): one of the keys in ``SORT_KEYS``
+            query (Query): an optional filtered query to page through
+
+        Returns:
+            a tuple of (promotions, next_key) where next_key is the sort key
+            to pass as ``after`` for the next page, or None on the last page
+        """
+        logger.info("Processing page query sort=%s after=%s limit=%s",
+                    sort, after, limit)
+        columns = [getattr(cls, name) for name in cls.SORT_KEYS[sort]]
+        if query is None:
+            query = cls.query
+        if after is not None:
+            if len(columns) == 1:
+                query = query.filter(columns[0] > after[0])
+            else:
+                query = query.filter(tuple_(*columns) > tuple_(*after))
+        # read one extra row to learn whether there is a next page
+        promotions = query.order_by(*columns).limit(limit + 1).all()
+        if len(promotions) <= limit:
+            return promotions, None
+        promotions = promotions[:limit]
+        last = promotions[-1]
+        return promotions, tuple(getattr(last, name) for name in cls.SORT_KEYS[sort])
+
+    @classmethod
+    def project(cls, query, fields, sort="id"):
+        """Narrows a query to only the given columns
+
+        The query then returns light weight rows instead of Promotions, so
+        only the requested columns are read and no entities are hydrated.
+        The id, version and sort key columns are always selected so that the
+        rows can still be paged, streamed and tagged.
+
+        Args:
+            query (Query): the query to narrow
+            fields (list): the names of the columns to select
+            sort (string): one of the keys in ``SORT_KEYS``
+        """
+        names = list(fields)
+        for name in ("id", "version") + cls.SORT_KEYS[sort]:
+            if name not in names:
+                names.append(name)
+        logger.info("Projecting query to %s", names)
+        return query.with_entities(*[getattr(cls, name) for name in names])
+
+    @classmethod
+    def stream(cls, query=None, batch_size=1000):
+        """Returns an iterator over Promotions that reads them in batches
+
+        The rows are fetched ``batch_size`` at a time through a server side
+        cursor (``yield_per``) so that only one batch is ever held in memory.
+
+        Args:
+            query (Query): an optional filtered query to stream
+            batch_size (int): the number of rows to fetch per round trip
+        """
+        logger.info("Processing streamed query in batches of %s", batch_size)
+        if query is None:
+            query = cls.query
+        return query.order_by(cls.id).yield_per(batch_size)
+
+    @classmethod
+    def export(cls, query=None, fields=("id",), batch_size=5000):
+        """Runs a query for an export and returns an iterator over its rows in batches
+
+        Only the given columns are selected and each row is a sequence of
+        their values in order, no Promotions are built. On PostgreSQL the
+        rows are read through a server side cursor, ``batch_size`` at a
+        time, so memory use does not grow with the table. The statement is
+        sent right away, the batches are fetched as the iterator is consumed.
+
+        Args:
+            query (Query): an optional filtered query to export
+            fields (list): the names of the columns to select
+            batch_size (int): the number of rows to fetch per round trip
+        """
+        logger.info("Processing export of %s in batches of %s", list(fields), batch_size)
+        if query is None:
+            query = cls.query
+        statement = (
+            query.with_entities(*[getattr(cls, name) for name in fields])
+            .order_by(cls.id)
+            .statement.execution_options(stream_results=True)
+        )
+        return cls._fetch_batches(db.session.execute(statement), batch_size)
+
+    @staticmethod
+    def _fetch_batches(result, batch_size):
+        try:
+            if db.engine.dialect.name == "postgresql":
+                # psycopg2 returns ready Python values, so its cursor is read
+                # directly, skipping SQLAlchemy's row by row buffering which
+                # takes most of the time. SQLAlchemy read one row ahead.
+                fetchmany = result.cursor.fetchmany
+                first = result.fetchone()
+                rows = [first] + fetchmany(batch_size - 1) if first is not None else []
+            else:
+                fetchmany = result.fetchmany
+                rows = fetchmany(batch_size)
+            while rows:
+                yield rows
+                rows = fetchmany(batch_size)
+        finally:
+            result.close()
+
     @classmethod
     def find(cls, promotion_id):
         """ Finds a Promotion by it's ID """
         logger.info("Processing lookup for id %s ...", promotion_id)
         try:
-            val=int(promotion_id)
-            return cls.query.get(promotion_id)
+            promotion_id = int(promotion_id)
         except Exception:
             return('Bad Request')
+        if cls.cache is not None:
+            row = cls.cache.get(promotion_id)
+            if row is not None:
+                return cls._from_cache(row)
+        promotion = cls.query.get(promotion_id)
+        if promotion is not None and cls.cache is not None:
+            cls.cache.set(promotion_id, promotion.to_cache())
+        return promotion
+
+    @classmethod
+    def find_fields(cls, promotion_id, fields):
+        """Finds the given columns of a Promotion by it's ID
+
+        The version is always selected so that the row has an ETag.
+        Returns None when there is no such Promotion.
+        """
+        logger.info("Processing lookup of %s for id %s ...", fields, promotion_id)
+        try:
+            promotion_id = int(promotion_id)
+        except (TypeError, ValueError):
+            return None
+        names = list(fields)
+        for name in ("id", "version"):
+            if name not in names:
+                names.append(name)
+        columns = [getattr(cls, name) for name in names]
+        return cls.query.with_entities(*columns).filter(cls.id == promotion_id).first()
+
+    @classmethod
+    def _from_cache(cls, row):
+        """Attaches a Promotion rebuilt from a cached row to the session
+
+        The instance is merged with load=False so no SELECT is issued, and it
+        can be updated or deleted just like one that was queried.
+        """
+        promotion = cls(**row)
+        make_transient_to_detached(promotion)
+        return db.session.merge(promotion, load=False)
+
+    @classmethod
+    def invalidate(cls, promotion_id):
+        """Drops a Promotion from the cache"""
+        if cls.cache is not None and promotion_id is not None:
+            cls.cache.invalidate(int(promotion_id))
+
+    @classmethod
+    def invalidate_all(cls):
+        """Drops every Promotion from the cache, used after set based changes"""
+        if cls.cache is not None:
+            cls.cache.clear()
+
+    @classmethod
+    def interval_index(cls):
+        """Returns the interval tree over the Promotion dates, or None
+
+        The tree is built from the database on first use and then kept up to
+        date by create, update and delete. Writes made by other processes are
+        picked up by rebuilding it once it is older than the app's
+        EFFECTIVE_INDEX_TTL seconds. Only one thread builds it, without
+        holding ``intervals_lock``: the others keep using the previous tree,
+        or get None when there is none yet. Callers must hold
+        ``intervals_lock`` while they read the tree.
+        """
+        ttl = cls.app.config.get("EFFECTIVE_INDEX_TTL", 60.0) if cls.app else 60.0
+        with cls.intervals_lock:
+            if cls.intervals_building or (
+                cls.intervals is not None and time.monotonic() - cls.intervals_built_at <= ttl
+            ):
+                return cls.intervals
+            cls.intervals_building, cls.intervals_pending = True, []
+        tree = None
+        try:
+            logger.info("Building the promotion interval index")
+            rows = db.session.query(cls.id, cls.start_date, cls.end_date).all()
+            tree = IntervalTree(
+                (promotion_id, start_date, end_date)
+                for promotion_id, start_date, end_date in rows
+                if start_date <= end_date
+            )
+        finally:
+            with cls.intervals_lock:
+                pending, cls.intervals_building, cls.intervals_pending = cls.intervals_pending, False, None
+                # a tree invalidated while it was built may already be stale
+                if tree is not None and pending is not None:
+                    cls.intervals, cls.intervals_built_at = tree, time.monotonic()
+                    for promotion_id, start_date, end_date in pending:
+                        cls._move_interval(promotion_id, start_date, end_date)
+        return cls.intervals
+
+    @classmethod
+    def invalidate_intervals(cls):
+        """Drops the interval tree so that it is rebuilt on next use"""
+        with cls.intervals_lock:
+            cls.intervals = None
+            cls.intervals_pending = None
+
+    @classmethod
+    def index_dates(cls, promotion_id, start_date, end_date):
+        """Adds or moves a Promotion in the interval tree if it has been built"""
+        with cls.intervals_lock:
+            if promotion_id is None:
+                return
+            start_date, end_date = as_datetime(start_date), as_datetime(end_date)
+            if start_date is None or end_date is None:
+                # dates the database understood but we cannot parse
+                cls.invalidate_intervals()
+                return
+            if cls.intervals_pending is not None:
+                cls.intervals_pending.append((promotion_id, start_date, end_date))
+            cls._move_interval(promotion_id, start_date, end_date)
+
+    @classmethod
+    def unindex_dates(cls, promotion_id):
+        """Removes a Promotion from the interval tree if it has been built"""
+        with cls.intervals_lock:
+            if cls.intervals_pending is not None:
+                cls.intervals_pending.append((promotion_id, None, None))
+            cls._move_interval(promotion_id, None, None)
+
+    @classmethod
+    def _move_interval(cls, promotion_id, start_date, end_date):
+        """Applies a change to the tree, removing the Promotion without dates"""
+        if cls.intervals is None:
+            return
+        if start_date is None or start_date > end_date:
+            cls.intervals.remove(promotion_id)
+        else:
+            cls.intervals.add(promotion_id, start_date, end_date)
+
+    @classmethod
+    def find_effective(cls, at):
+        """Returns the Promotions whose start and end dates include a moment
+
+        Args:
+            at (datetime): the moment the Promotions must be in effect at
+        """
+        logger.info("Processing effective query at %s ...", at)
+        at = as_datetime(at)
+        # the dates are checked again since the tree may be stale, so it can
+        # miss rows changed by other workers but never return wrong ones
+        criteria = (cls.start_date <= at, cls.end_date >= at)
+        tree = cls.interval_index()
+        if tree is None:
+            return cls._find_where(*criteria)
+        with cls.intervals_lock:
+            ids = tree.at(at)
+        return cls._find_ids(ids, *criteria)
+
+    @classmethod
+    def find_overlapping(cls, start, end):
+        """Returns the Promotions that are in effect at any time in a window
+
+        Args:
+            start (datetime): the start of the window
+            end (datetime): the end of the window
+        """
+        logger.info("Processing overlap query for %s to %s ...", start, end)
+        start, end = as_datetime(start), as_datetime(end)
+        if start > end:
+            raise DataValidationError("Invalid window: start is after end")
+        criteria = (cls.start_date <= end, cls.end_date >= start)
+        tree = cls.interval_index()
+        if tree is None:
+            return cls._find_where(*criteria)
+        with cls.intervals_lock:
+            ids = tree.overlapping(start, end)
+        return cls._find_ids(ids, *criteria)
+
+    @classmethod
+    def ngram_index(cls):
+        """Returns the trigram index over the Promotion titles and types
+
+        Like the interval tree it is built on first use, kept up to date by
+        create, update and delete and rebuilt once it is older than the
+        app's SEARCH_INDEX_TTL seconds. Callers must hold ``ngrams_lock``.
+        """
+        ttl = cls.app.config.get("SEARCH_INDEX_TTL", 60.0) if cls.app else 60.0
+        if cls.ngrams is None or time.monotonic() - cls.ngrams_built_at > ttl:
+            logger.info("Building the promotion search index")
+            rows = db.session.query(cls.id, cls.title, cls.promotion_type)
+            cls.ngrams = NgramIndex(rows)
+            cls.ngrams_built_at = time.monotonic()
+        return cls.ngrams
+
+    @classmethod
+    def invalidate_search(cls):
+        """Drops the trigram index so that it is rebuilt on next use"""
+        with cls.ngrams_lock:
+            cls.ngrams = None
+
+    @classmethod
+    def index_text(cls, promotion_id, title, promotion_type):
+        """Adds or updates a Promotion in the trigram index if it has been built"""
+        with cls.ngrams_lock:
+            if cls.ngrams is not None and promotion_id is not None:
+                cls.ngrams.add(promotion_id, title, promotion_type)
+
+    @classmethod
+    def unindex_text(cls, promotion_id):
+        """Removes a Promotion from the trigram index if it has been built"""
+        with cls.ngrams_lock:
+            if cls.ngrams is not None:
+                cls.ngrams.remove(promotion_id)
+
+    @classmethod
+    def has_trigram_search(cls):
+        """Returns whether the database can search with pg_trgm"""
+        if cls.trigram_search is None:
+            cls.trigram_search = db.engine.dialect.name == "postgresql" and bool(
+                db.session.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").scalar()
+            )
+        return cls.trigram_search
+
+    @classmethod
+    def search(cls, text, limit=10):
+        """Returns the Promotions whose title or type best match a search box
+
+        Words of the query match words of the title or type that start with
+        them or that share most of their trigrams, so prefixes and typos are
+        found. PostgreSQL with pg_trgm ranks the rows in the database, other
+        backends use the in-memory trigram index.
+
+        Args:
+            text (string): the query
+            limit (int): the most Promotions to return
+
+        Returns:
+            a list of (Promotion, similarity) tuples, the most similar first
+            and then by id
+        """
+        logger.info("Processing search for %s ...", text)
+        threshold = cls.app.config.get("SEARCH_SIMILARITY_THRESHOLD", 0.6) if cls.app else 0.6
+        if cls.has_trigram_search():
+            return cls._search_trigrams(text, limit, threshold)
+        with cls.ngrams_lock:
+            ranked = cls.ngram_index().search(text, limit, threshold)
+        promotions = {promotion.id: promotion for promotion in cls._find_ids([key for _, key in ranked])}
+        return [(promotions[key], score) for score, key in ranked if key in promotions]
+
+    @classmethod
+    def _search_trigrams(cls, text, limit, threshold):
+        """Searches with the pg_trgm word similarity operators
+
+        Each column's GiST index returns its nearest rows first, ``ORDER BY
+        q <<-> title LIMIT k``, so only the k best rows of each column are
+        read and ranked however many rows match.
+        """
+        # the <% operator matches at pg_trgm.word_similarity_threshold
+        db.session.execute(
+            "SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)",
+            {"threshold": str(threshold)},
+        )
+        query = literal(text)
+        # psycopg2 reads a lone % as a placeholder, <%% is sent as <%
+
+        def nearest(column):
+            distance = query.op("<<->")(column)
+            return (
+                select([cls.id.label("id"), distance.label("distance")])
+                .where(query.op("<%%")(column))
+                .order_by(distance)
+                .limit(limit)
+            )
+
+        both = union_all(nearest(cls.title), nearest(cls.promotion_type)).alias("nearest")
+        best = (
+            select([both.c.id, func.min(both.c.distance).label("distance")])
+            .group_by(both.c.id)
+            .alias("best")
+        )
+        rows = (
+            db.session.query(cls, best.c.distance)
+            .join(best, cls.id == best.c.id)
+            .order_by(best.c.distance, cls.id)
+            .limit(limit)
+        )
+        return [(promotion, 1.0 - distance) for promotion, distance in rows]
+
+    @classmethod
+    def _find_ids(cls, ids, *criteria):
+        """Returns the Promotions with the given ids that still match the
+        criteria, ordered by id"""
+        if not ids:
+            return []
+        return cls._find_where(cls.id.in_(ids), *criteria)
+
+    @classmethod
+    def _find_where(cls, *criteria):
+        """Returns the Promotions matching every criterion ordered by id"""
+        return cls.query.filter(*criteria).order_by(cls.id).all()
 
     @classmethod
     def find_or_404(cls, promotion_id):
@@ -155,6 +803,261 @@ class Promotion(db.Model):
         logger.info("Processing lookup or 404 for id %s ...", promotion_id)
         return cls.query.get_or_404(promotion_id)
 
+    @classmethod
+    def find_by_filters(cls, **filters):
+        """Returns all Promotions that match every one of the given filters
+
+        The filters are ANDed together into a single query so that any
+        combination of them is evaluated by the database. Filters with a
+        value of None are ignored.
+
+        Args:
+            filters: keyword arguments named after the keys of ``FILTERS``,
+                e.g. ``promotion_type="20%OFF", active=True, end_date_lt=now``
+        """
+        logger.info("Processing filtered query for %s ...", filters)
+        clauses = []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name not in cls.FILTERS:
+                raise DataValidationError("Invalid filter: " + name)
+            if name == "active_on":
+                clauses.append(and_(cls.start_date <= value, cls.end_date >= value))
+            else:
+                column, compare = cls.FILTERS[name]
+                clauses.append(compare(getattr(cls, column), value))
+        return cls.query.filter(*clauses)
+
+    @classmethod
+    def update_if_version(cls, promotion_id, version, promotion):
+        """Updates a Promotion only if it is still at the given version
+
+        Runs as a single ``UPDATE ... WHERE id=:id AND version=:version`` so
+        a client that knows the version (from an ETag) does not need the
+        Promotion to be read first.
+
+        Args:
+            promotion_id (int): the id of the Promotion to update
+            version (int): the version the client last saw
+            promotion (Promotion): a deserialized Promotion with the new values
+
+        Returns:
+            the updated Promotion, or None when it does not exist or has
+            moved on to another version
+        """
+        logger.info("Updating id %s if at version %s", promotion_id, version)
+        return cls._update_returning(promotion_id, promotion.to_row(), cls.version == version)
+
+    @classmethod
+    def set_active(cls, promotion_id, active):
+        """Activates or deactivates a Promotion in a single statement
+
+        Runs ``UPDATE promotion SET active=:active WHERE id=:id RETURNING *``
+        and commits it, so no prior SELECT is needed.
+
+        Args:
+            promotion_id (int): the id of the Promotion to change
+            active (boolean): the new active state
+
+        Returns:
+            the updated Promotion, or None if there is no such Promotion
+        """
+        logger.info("Setting active=%s on id %s", active, promotion_id)
+        return cls._update_returning(promotion_id, {"active": active})
+
+    @classmethod
+    def _update_returning(cls, promotion_id, values, *criteria):
+        """Updates one row, bumping its version, and returns it as a Promotion
+
+        PostgreSQL does this in one round trip with ``UPDATE ... RETURNING``,
+        other backends read the row back in the same transaction.
+        """
+        table = cls.__table__
+        statement = (
+            table.update()
+            .where(and_(table.c.id == promotion_id, *criteria))
+            .values(values)
+            .values(version=table.c.version + 1)
+        )
+        if db.engine.dialect.name == "postgresql":
+            row = db.session.execute(statement.returning(*table.c)).first()
+        else:
+            row = None
+            if db.session.execute(statement).rowcount:
+                row = db.session.execute(
+                    table.select().where(table.c.id == promotion_id)
+                ).first()
+        db.session.commit()
+        if row is None:
+            return None
+        promotion = cls(**dict(row))
+        cls.invalidate(promotion.id)
+        cls.index_dates(promotion.id, promotion.start_date, promotion.end_date)
+        cls.index_text(promotion.id, promotion.title, promotion.promotion_type)
+        return promotion
+
+    @classmethod
+    def count(cls, query=None, estimate_over=None):
+        """Counts the Promotions of a query without loading them
+
+        Runs ``SELECT count(id) ... WHERE ...``. When ``estimate_over`` is
+        given and the planner expects at least that many rows, the planner's
+        estimate is returned instead so that very large tables are not
+        scanned (PostgreSQL only).
+
+        Returns:
+            a tuple of (count, estimated)
+        """
+        if query is None:
+            query = cls.query
+        if estimate_over is not None and db.engine.dialect.name == "postgresql":
+            estimate = cls.estimate_count(query)
+            if estimate >= estimate_over:
+                logger.info("Estimated %s Promotions", estimate)
+                return estimate, True
+        count = query.with_entities(func.count(cls.id)).order_by(None).scalar()
+        logger.info("Counted %s Promotions", count)
+        return count, False
+
+    @classmethod
+    def estimate_count(cls, query=None):
+        """Returns the number of rows the PostgreSQL planner expects a query
+        to return, read from ``EXPLAIN`` so that no rows are touched"""
+        if query is None:
+            query = cls.query
+        compiled = query.with_entities(cls.id).order_by(None).statement.compile(dialect=db.engine.dialect)
+        plan = db.session.connection().execute(
+            "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    @classmethod
+    def set_active_where(cls, active, **filters):
+        """Activates or deactivates every Promotion matching the filters
+
+        Runs as a single ``UPDATE promotion SET active=:active WHERE ...``.
+        Rows that already have the requested state are left untouched.
+
+        Returns:
+            the number of Promotions that were changed
+        """
+        logger.info("Setting active=%s on Promotions matching %s", active, filters)
+        query = cls.find_by_filters(**filters).filter(cls.active != active)
+        count = query.update(
+            {cls.active: active, cls.version: cls.version + 1}, synchronize_session=False
+        )
+        db.session.commit()
+        cls.invalidate_all()
+        return count
+
+    @classmethod
+    def activate_started(cls, since, until, batch_size=1000):
+        """Activates the Promotions that started after since and up to until
+
+        Only Promotions still running at until are activated. With since of
+        None every Promotion running at until is. A Promotion written after
+        since with a start_date before it is left with the active it was
+        written with, like one deactivated by hand.
+
+        Returns:
+            the number of Promotions that were activated
+        """
+        criteria = [cls.start_date <= until, cls.end_date >= until]
+        if since is not None:
+            criteria.append(cls.start_date > since)
+        logger.info("Activating Promotions started from %s to %s", since, until)
+        return cls._set_active_batches(True, criteria, batch_size)
+
+    @classmethod
+    def expire_ended(cls, since, until, batch_size=1000):
+        """Deactivates the Promotions that ended from since and before until
+
+        Promotions written after since that have already ended, created or
+        moved into the past, are deactivated too. With since of None every
+        Promotion that ended before until is.
+
+        Returns:
+            the number of Promotions that were deactivated
+        """
+        criteria = [cls.end_date < until]
+        if since is not None:
+            criteria.append(or_(cls.end_date >= since, cls.updated_at > since))
+        logger.info("Expiring Promotions ended from %s to %s", since, until)
+        return cls._set_active_batches(False, criteria, batch_size)
+
+    @classmethod
+    def _set_active_batches(cls, active, criteria, batch_size):
+        """Sets active on the matching rows with one UPDATE per batch
+
+        Every batch is committed on its own so that no transaction holds
+        many row locks. Locked rows are waited for rather than skipped, a
+        skipped row would be left behind once the watermark moves on.
+        """
+        table = cls.__table__
+        batch = (
+            select([table.c.id])
+            .where(and_(table.c.active == (not active), *criteria))
+            .limit(batch_size)
+        )
+        postgresql = db.engine.dialect.name == "postgresql"
+        total = 0
+        while True:
+            statement = table.update().values(active=active, version=table.c.version + 1)
+            if postgresql:
+                # UPDATE ... WHERE id IN (SELECT ...) RETURNING id
+                result = db.session.execute(
+                    statement.where(table.c.id.in_(batch)).returning(table.c.id)
+                )
+                ids = [row[0] for row in result]
+            else:
+                ids = [row[0] for row in db.session.execute(batch)]
+                if ids:
+                    db.session.execute(statement.where(table.c.id.in_(ids)))
+            db.session.commit()
+            for promotion_id in ids:
+                cls.invalidate(promotion_id)
+            total += len(ids)
+            if len(ids) < batch_size:
+                return total
+
+    @classmethod
+    def delete_by_id(cls, promotion_id):
+        """Deletes a Promotion in a single statement
+
+        Runs ``DELETE FROM promotion WHERE id=:id`` without the version
+        check of ``delete``, so a copy read from the cache that another
+        worker has since changed or deleted cannot make it fail.
+
+        Returns:
+            True if a Promotion was deleted
+        """
+        logger.info("Deleting id %s", promotion_id)
+        table = cls.__table__
+        count = db.session.execute(table.delete().where(table.c.id == promotion_id)).rowcount
+        db.session.commit()
+        cls.invalidate(promotion_id)
+        cls.unindex_dates(promotion_id)
+        cls.unindex_text(promotion_id)
+        return count > 0
+
+    @classmethod
+    def delete_where(cls, **filters):
+        """Deletes every Promotion matching the filters in a single DELETE
+
+        Returns:
+            the number of Promotions that were deleted
+        """
+        logger.info("Deleting Promotions matching %s", filters)
+        count = cls.find_by_filters(**filters).delete(synchronize_session=False)
+        db.session.commit()
+        cls.invalidate_all()
+        cls.invalidate_intervals()
+        cls.invalidate_search()
+        return count
+
     @classmethod
     def find_by_promotiontype(cls, promotion_type):
         """Returns all Promotions with the given promotion_type
@@ -162,9 +1065,7 @@ class Promotion(db.Model):
         Args:
             promotion_type (string): the promotion_type of the Promotions you want to match
         """
-        logger.info("Processing promotion_type query for %s ...",
-                    promotion_type)
-        return cls.query.filter(cls.promotion_type == promotion_type)
+        return cls.find_by_filters(promotion_type=promotion_type)
 
     @classmethod
     def find_by_active(cls, active):
@@ -173,9 +1074,7 @@ class Promotion(db.Model):
             Args:
                 active (boolean): the active of the Promotions you want to match
             """
-        logger.info("Processing active query for %s ...",
-                    active)
-        return cls.query.filter(cls.active == active)
+        return cls.find_by_filters(active=active)
 
     @classmethod
     def find_by_title(cls, title):
@@ -184,9 +1083,7 @@ class Promotion(db.Model):
             Args:
                 title (String): the active of the Promotions you want to match
             """
-        logger.info("Processing active query for %s ...",
-                    title)
-        return cls.query.filter(cls.title == title)
+        return cls.find_by_filters(title=title)
 
     @classmethod
     def find_by_end_date(cls, end_date):
@@ -195,6 +1092,29 @@ class Promotion(db.Model):
             Args:
                 end_date (Datetime): the active of the Promotions you want to match
             """
-        logger.info("Processing active query for %s ...",
-                    end_date)
-        return cls.query.filter(cls.end_date == end_date)
+        return cls.find_by_filters(end_date=end_date)
+
+
+class Watermark(db.Model):
+    """
+    The moment up to which a background job has processed the Promotions
+    """
+
+    name = db.Column(db.String(63), primary_key=True)
+    value = db.Column(db.DateTime(), nullable=False)
+
+    def __repr__(self):
+        return "<Watermark %r value=[%s]>" % (self.name, self.value)
+
+    @classmethod
+    def get(cls, name):
+        """Returns the watermark of a job, or None before its first run"""
+        watermark = cls.query.get(name)
+        return watermark.value if watermark else None
+
+    @classmethod
+    def advance(cls, name, value):
+        """Stores the watermark of a job"""
+        logger.info("Advancing the %s watermark to %s", name, value)
+        db.session.merge(cls(name=name, value=value))
+        db.session.commit()
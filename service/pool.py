@@ -0,0 +1,67 @@
+"""
+Database connection pool for the Promotion Service
+
+TimedQueuePool - a QueuePool that measures how long every checkout waits
+for a connection, so that an undersized pool shows up as wait time
+instead of as slow requests with no explanation.
+"""
+import time
+import logging
+import threading
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("flask.app")
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records the time spent waiting for a connection
+
+    Checkouts that wait longer than ``slow_checkout`` seconds are logged as
+    warnings together with the state of the pool. Every wait is also passed
+    to ``wait_listener`` when one is set, the metrics use it.
+    """
+
+    wait_listener = None
+
+    def __init__(self, creator, slow_checkout=0.1, **kw):
+        super().__init__(creator, **kw)
+        self.slow_checkout = slow_checkout
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def recreate(self):
+        """Returns a new, empty pool with the same settings, used by Engine.dispose()"""
+        pool = super().recreate()
+        pool.slow_checkout = self.slow_checkout
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            if self.wait_listener is not None:
+                self.wait_listener(waited)
+            if waited > self.slow_checkout:
+                logger.warning("Waited %.3fs for a database connection (%s)", waited, self.status())
+
+    def stats(self):
+        """Returns the checkout count and wait times together with the pool usage"""
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "overflow": self.overflow(),
+                "checkouts": self.checkouts,
+                "wait_total": self.wait_total,
+                "wait_max": self.wait_max,
+                "wait_avg": self.wait_total / self.checkouts if self.checkouts else 0.0,
+            }
@@ -0,0 +1,173 @@
+######################################################################
+# SQL Statement Accounting
+######################################################################
+"""
+Counts and times the SQL statements run by every request
+
+Statements are seen through the SQLAlchemy engine events, so everything
+the models run is accounted for, including the statements issued by the
+ORM itself. Each request gets:
+
+* a ``Server-Timing`` header with the statement count and database time
+* a warning for every statement slower than SLOW_QUERY_THRESHOLD seconds
+* a warning when one statement runs N_PLUS_ONE_THRESHOLD times or more
+* a query budget check for the views decorated with ``query_budget``, or
+  that set their own with ``set_query_budget``;
+  with QUERY_BUDGET_STRICT a view that goes over its budget raises
+  QueryBudgetExceeded, which fails the test that called it
+"""
+import time
+import logging
+import functools
+from collections import Counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service.models import db
+from . import app
+
+logger = logging.getLogger("flask.app")
+
+# longest parameter list written to the slow query log
+MAX_LOGGED_PARAMETERS = 500
+
+
+class QueryBudgetExceeded(Exception):
+    """ Raised in strict mode when a view runs more statements than its budget """
+
+
+class RequestQueries:
+    """ The statements run while answering one request """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.budget = None
+
+    def add(self, statement, elapsed):
+        """ Accounts for one statement that took elapsed seconds """
+        self.count += 1
+        self.seconds += elapsed
+        self.statements[statement] += 1
+
+    def server_timing(self):
+        """ Returns the value of the Server-Timing header """
+        return 'db;dur={:.2f};desc="{} {}", total;dur={:.2f}'.format(
+            self.seconds * 1000, self.count, "query" if self.count == 1 else "queries",
+            (time.perf_counter() - self.started) * 1000,
+        )
+
+
+######################################################################
+# U T I L I T Y   F U N C T I O N S
+######################################################################
+
+
+def request_queries():
+    """ Returns the statements of the request being answered, or None """
+    if has_request_context():
+        return g.get("sql")
+    return None
+
+
+def route_name():
+    """ Returns the method and URL rule of the request being answered """
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    return "{} {}".format(request.method, rule)
+
+
+def query_budget(statements, without_returning=None):
+    """ Declares the most SQL statements a view may run
+
+    without_returning, when given, is the budget on databases other than
+    PostgreSQL, where the models read a written row back with a SELECT
+    instead of using RETURNING.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if without_returning is not None and db.engine.dialect.name != "postgresql":
+                set_query_budget(without_returning)
+            else:
+                set_query_budget(statements)
+            return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_query_budget(statements):
+    """ Changes the budget of the request being answered, for the views
+    whose statement count depends on the size of their input """
+    sql = request_queries()
+    if sql is not None:
+        sql.budget = statements
+
+
+######################################################################
+# D A T A B A S E   E V E N T S
+######################################################################
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """ Notes when a statement was sent to the database """
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """ Accounts the statement to the request and logs it when it is slow """
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    sql = request_queries()
+    if sql is None:
+        return
+    sql.add(statement, elapsed)
+    if elapsed > app.config["SLOW_QUERY_THRESHOLD"]:
+        logger.warning(
+            "Slow query (%.1f ms) on %s: %s with %s", elapsed * 1000, route_name(),
+            " ".join(statement.split()), repr(parameters)[:MAX_LOGGED_PARAMETERS],
+        )
+
+
+@event.listens_for(Engine, "handle_error")
+def drop_query_timer(exception_context):
+    """ Forgets the start of a statement that failed, after_cursor_execute
+    is not called for it """
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+######################################################################
+# R E Q U E S T   H O O K S
+######################################################################
+
+
+@app.before_request
+def start_accounting():
+    """ Starts counting the statements of the request """
+    g.sql = RequestQueries()
+
+
+@app.after_request
+def check_queries(response):
+    """ Adds the Server-Timing header and checks the query budget """
+    sql = g.get("sql")
+    if sql is None:
+        return response
+    if app.config["SERVER_TIMING_ENABLED"]:
+        response.headers["Server-Timing"] = sql.server_timing()
+    if sql.statements:
+        statement, repeats = sql.statements.most_common(1)[0]
+        if repeats >= app.config["N_PLUS_ONE_THRESHOLD"]:
+            logger.warning("Possible N+1 queries on %s, ran %s times: %s",
+                           route_name(), repeats, " ".join(statement.split()))
+    if sql.budget is not None and sql.count > sql.budget:
+        message = "{} ran {} SQL statements, over its budget of {}".format(
+            route_name(), sql.count, sql.budget)
+        if app.config["QUERY_BUDGET_STRICT"]:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
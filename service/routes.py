@@ -3,29 +3,45 @@ Promotion  Service
 Paths:
 ------
 GET /promotions - Returns a list all of the Promotions
+GET /promotions?limit={n}&cursor={cursor} - Returns one page of Promotions
+GET /promotions?stream=1 - Streams the Promotions as newline delimited JSON
+GET /promotions?total=exact|estimate - Adds the number of matching Promotions in X-Total-Count
+HEAD /promotions - Returns only the X-Total-Count of the Promotions
+GET /promotions/count - Returns the number of Promotions matching the filters
+GET /promotions/effective?at={datetime} - Returns the Promotions in effect at a moment
+GET /promotions/effective?from={datetime}&to={datetime} - Returns the Promotions in effect during a window
+GET /promotions/search?q={text} - Returns the Promotions whose title or type best match a search box
+GET /promotions/export?format=csv|ndjson&compress=gzip - Streams every matching Promotion as a CSV or NDJSON file
+GET /promotions?fields={names} - Returns only the named fields of the Promotions
 GET /promotions/{id} - Returns the Promotion with a given id number
+GET /promotions/{id}?fields={names} - Returns only the named fields of a Promotion
 POST /promotions - creates a new Promotion record in the database
+POST /promotions/bulk - creates many Promotion records in batches
 PUT /promotions/{id} - updates a Promotion record in the database
 DELETE /promotions/{id} - deletes a Promotion record in the database
 PUT /promotions/{id}/activate - activates a Promotion with a given id number
 PUT /promotions/{id}/deactivate - deactivates a Promotion with a given id number
+PUT /promotions/activate?{filters} - activates every Promotion matching the filters
+PUT /promotions/deactivate?{filters} - deactivates every Promotion matching the filters
+DELETE /promotions?{filters} - deletes every Promotion matching the filters
 """
 
-import os
-import sys
-import uuid
-import logging
-from functools import wraps
-from flask import Flask, jsonify, request, url_for, make_response, abort
+import json
+import zlib
+import base64
+import hashlib
+import itertools
+from datetime import datetime
+from flask import Response, request, stream_with_context
 from flask_restx import Api, Resource, fields, reqparse, inputs
 from werkzeug.exceptions import NotFound
+from werkzeug.http import quote_etag
+from sqlalchemy.orm.exc import StaleDataError
 from . import status  # HTTP Status Codes
 
-
-# For this example we'll use SQLAlchemy, a popular ORM that supports a
-# variety of backends including SQLite, MySQL, and PostgreSQL
-from flask_sqlalchemy import SQLAlchemy
-from service.models import Promotion, DataValidationError
+from service.models import db, Promotion, DataValidationError
+from service.serializers import CsvSerializer, PromotionSerializer, PROMOTION_FIELDS, json_backend
+from service.queries import query_budget, set_query_budget
 
 # Import Flask application
 from . import app
@@ -77,12 +93,119 @@ promotion_model = api.inherit(
 )
 
 
-# query string arguments
-promotion_args = reqparse.RequestParser()
-promotion_args.add_argument('title', type=str, required=False, location='args', help='List Promotions by title')
-promotion_args.add_argument('promotion_type', type=str, required=False,location='args', help='List Promotions by type')
-promotion_args.add_argument('end_date', type=inputs.datetime_from_iso8601, required=False,location='args', help='List Promotions by end date')
-promotion_args.add_argument('active', type=inputs.boolean, required=False,location='args', help='List Promotions by active status')
+search_result_model = api.inherit(
+    'SearchResult',
+    promotion_model,
+    {
+        'score': fields.Float(description='How similar the title or type is to the query, 0 to 1'),
+    }
+)
+
+
+# media type of the streamed listing, one JSON document per line
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# media types of the export formats
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': NDJSON_MIMETYPE}
+
+# page sizes used by the keyset pagination on the collection
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# number of results of the search box
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 100
+
+bulk_error_model = api.model('BulkError', {
+    'index': fields.Integer(description='The position of the Promotion in the request'),
+    'error': fields.String(description='Why the Promotion was not created'),
+})
+
+bulk_count_model = api.model('BulkCount', {
+    'count': fields.Integer(description='The number of Promotions that were changed'),
+})
+
+count_model = api.model('PromotionCount', {
+    'count': fields.Integer(description='The number of Promotions matching the filters'),
+    'estimated': fields.Boolean(description='Whether the count is the query planner\'s estimate'),
+})
+
+bulk_result_model = api.model('BulkResult', {
+    'ids': fields.List(fields.Integer, description='The ids of the created Promotions in request order'),
+    'errors': fields.List(fields.Nested(bulk_error_model), description='The Promotions that were not created'),
+})
+
+def id_list(value):
+    """ Parses a comma separated list of Promotion ids """
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise ValueError('ids must be a comma separated list of integers')
+
+
+def field_list(value):
+    """ Parses a comma separated list of Promotion field names """
+    names = []
+    for name in value.split(','):
+        name = name.strip()
+        if name not in PROMOTION_FIELDS:
+            raise ValueError('fields must be a comma separated list of {}'.format(', '.join(PROMOTION_FIELDS)))
+        if name not in names:
+            names.append(name)
+    return tuple(names)
+
+
+# writes Promotions straight to JSON bytes, the models above are kept for
+# the Swagger docs and for request bodies
+serializer = PromotionSerializer(dumps=json_backend(app.config['JSON_ENCODER']))
+
+# query string arguments that select Promotions
+filter_args = reqparse.RequestParser()
+filter_args.add_argument('ids', type=id_list, required=False, location='args', help='Select Promotions by a comma separated list of ids')
+filter_args.add_argument('title', type=str, required=False, location='args', help='List Promotions by title')
+filter_args.add_argument('promotion_type', type=str, required=False,location='args', help='List Promotions by type')
+filter_args.add_argument('end_date', type=inputs.datetime_from_iso8601, required=False,location='args', help='List Promotions by end date')
+filter_args.add_argument('active', type=inputs.boolean, required=False,location='args', help='List Promotions by active status')
+filter_args.add_argument('start_date', type=inputs.datetime_from_iso8601, required=False, location='args', help='List Promotions by start date')
+filter_args.add_argument('start_date_lt', type=inputs.datetime_from_iso8601, required=False, location='args', help='List Promotions starting before a date')
+filter_args.add_argument('start_date_gte', type=inputs.datetime_from_iso8601, required=False, location='args', help='List Promotions starting on or after a date')
+filter_args.add_argument('end_date_lt', type=inputs.datetime_from_iso8601, required=False, location='args', help='List Promotions ending before a date')
+filter_args.add_argument('end_date_gte', type=inputs.datetime_from_iso8601, required=False, location='args', help='List Promotions ending on or after a date')
+filter_args.add_argument('active_on', type=inputs.datetime_from_iso8601, required=False, location='args', help='List Promotions running on a date')
+
+# query string argument that picks the fields to return
+fields_args = reqparse.RequestParser()
+fields_args.add_argument('fields', type=field_list, required=False, location='args', help='Return only these comma separated fields')
+
+# query string arguments of the counts
+count_args = filter_args.copy()
+count_args.add_argument('total', type=str, required=False, location='args', choices=['exact', 'estimate'], default='exact', help='Count exactly, or estimate from planner statistics on large tables')
+
+# query string arguments of the effective promotions query
+effective_args = reqparse.RequestParser()
+effective_args.add_argument('at', type=inputs.datetime_from_iso8601, required=False, location='args', help='List Promotions in effect at this moment, defaults to now')
+effective_args.add_argument('from', type=inputs.datetime_from_iso8601, required=False, location='args', help='List Promotions in effect at any time from this moment')
+effective_args.add_argument('to', type=inputs.datetime_from_iso8601, required=False, location='args', help='List Promotions in effect at any time up to this moment')
+
+# query string arguments of the search box
+search_args = reqparse.RequestParser()
+search_args.add_argument('q', type=str, required=True, location='args', help='Words or prefixes of the title or type, typos allowed')
+search_args.add_argument('limit', type=inputs.int_range(1, MAX_SEARCH_LIMIT), required=False, location='args', default=DEFAULT_SEARCH_LIMIT, help='Maximum number of Promotions to return')
+
+# query string arguments of the export
+export_args = filter_args.copy()
+export_args.add_argument(fields_args.args[0])
+export_args.add_argument('format', type=str, required=False, location='args', choices=list(EXPORT_MIMETYPES), default='csv', help='Write the Promotions as CSV or newline delimited JSON')
+export_args.add_argument('compress', type=str, required=False, location='args', choices=['gzip'], help='Compress the file with gzip')
+
+# query string arguments of the listing
+promotion_args = filter_args.copy()
+promotion_args.add_argument(fields_args.args[0])
+promotion_args.add_argument('total', type=str, required=False, location='args', choices=['exact', 'estimate'], help='Add the number of matching Promotions in X-Total-Count')
+promotion_args.add_argument('limit', type=inputs.int_range(1, MAX_PAGE_SIZE), required=False, location='args', help='Maximum number of Promotions per page')
+promotion_args.add_argument('cursor', type=str, required=False, location='args', help='Opaque cursor returned by the previous page')
+promotion_args.add_argument('stream', type=inputs.boolean, required=False, location='args', help='Stream the Promotions as newline delimited JSON')
+promotion_args.add_argument('sort', type=str, required=False, location='args', choices=list(Promotion.SORT_KEYS), default='id', help='Key to page through the Promotions by')
 
 
 
@@ -105,36 +228,61 @@ class PromotionResource(Resource):
     # RETRIEVE A PROMOTION
     ######################################################################
     @api.doc('get_promotions')
+    @api.expect(fields_args, validate=True)
     @api.response(404, 'Promotion not found')
-    @api.marshal_with(promotion_model)
+    @api.response(304, 'Promotion not modified since the ETag in If-None-Match')
+    @api.response(200, 'Success', promotion_model)
+    @query_budget(1)
     def get(self, promotion_id):
         """
         Retrieve a single Promotion
         This endpoint will return a Promotion based on it's id
         """
         app.logger.info("Request for promotion with id: [%s]", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        fields = fields_args.parse_args()['fields']
+        if fields:
+            promotion = Promotion.find_fields(promotion_id, fields)
+        else:
+            promotion = Promotion.find(promotion_id)
         if not promotion:
             raise NotFound(
                 "Promotion with id '{}' was not found.".format(promotion_id))        
-        return promotion.serialize(), status.HTTP_200_OK
+        # a projection is not the byte for byte representation that the
+        # version tags, so its ETag is weak and cannot be used in If-Match
+        etag = promotion_etag(promotion)
+        headers = {'ETag': quote_etag(etag, weak=bool(fields))}
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(
+            serializer_for(fields).one(promotion),
+            status=status.HTTP_200_OK,
+            mimetype='application/json',
+            headers=headers,
+        )
 
     ######################################################################
     # UPDATE AN EXISTING PROMOTION
     ######################################################################
     @api.response(404, 'Promotion not found')
     @api.response(400, 'The posted Promotion data was not valid')
+    @api.response(409, 'The Promotion was changed by another request')
+    @api.response(412, 'The Promotion does not match the ETag in If-Match')
     @api.response(415, 'Invalid Content Type')
     @api.doc('update_promotions')
     @api.expect(create_model)
     @api.marshal_with(promotion_model)
+    @query_budget(3)
     def put(self, promotion_id):
         """
         Update a Promotion
-        This endpoint will update a Promotion based the body that is posted
+        This endpoint will update a Promotion based the body that is posted.
+        With an If-Match ETag the update is made in one statement, only if
+        the Promotion is still at that version.
         """
         app.logger.info("Request to update promotion with id: [%s]", promotion_id)
         # check_content_type("application/json")
+        if request.if_match and not request.if_match.star_tag:
+            return self.put_if_match(promotion_id)
         promotion = Promotion.find(promotion_id)
         if not promotion:
             raise NotFound(
@@ -151,24 +299,47 @@ class PromotionResource(Resource):
             promotion.update()
 
             app.logger.info("Promotion with ID [%s] updated.", promotion.id)
-            return promotion.serialize(), status.HTTP_200_OK
+            return promotion.serialize(), status.HTTP_200_OK, {'ETag': quote_etag(promotion_etag(promotion))}
+        except StaleDataError:
+            Promotion.invalidate(promotion_id)
+            api.abort(status.HTTP_409_CONFLICT, 'Promotion was changed by another request')
+        except Exception:
+            api.abort(status.HTTP_400_BAD_REQUEST, 'Bad Request')
+
+    def put_if_match(self, promotion_id):
+        """ Updates a Promotion without reading it first, using the version in If-Match """
+        version = etag_version(request.if_match, promotion_id)
+        if version is None:
+            abort(status.HTTP_412_PRECONDITION_FAILED, 'If-Match does not match this Promotion')
+        try:
+            promotion = Promotion.update_if_version(
+                int(promotion_id), version, Promotion().deserialize(api.payload)
+            )
         except Exception:
             api.abort(status.HTTP_400_BAD_REQUEST, 'Bad Request')
+        if promotion is None:
+            if not Promotion.find(promotion_id):
+                raise NotFound(
+                    "Promotion with id '{}' was not found.".format(promotion_id))
+            abort(status.HTTP_412_PRECONDITION_FAILED, 'Promotion has been changed since it was read')
+        app.logger.info("Promotion with ID [%s] updated.", promotion.id)
+        return promotion.serialize(), status.HTTP_200_OK, {'ETag': quote_etag(promotion_etag(promotion))}
 
     ######################################################################
     # DELETE A PROMOTION
     ######################################################################
     @api.doc('delete_promotions')
     @api.response(204, 'Promotion deleted')
+    @query_budget(1)
     def delete(self, promotion_id):
         """
         Delete a Promotion
         This endpoint will delete a Promotion based the id specified in the path
         """
         app.logger.info("Request to delete promotion with id: [%s]", promotion_id)
-        promotion = Promotion.find(promotion_id)
-        if promotion:
-            promotion.delete()
+        # deleted by id rather than through Promotion.find, a cached copy may
+        # be stale and would fail the version check of Promotion.delete
+        if str(promotion_id).isdigit() and Promotion.delete_by_id(int(promotion_id)):
             app.logger.info("Promotion with ID [%s] delete complete.", promotion_id)
         return '', status.HTTP_204_NO_CONTENT
 
@@ -184,7 +355,9 @@ class PromotionCollection(Resource):
 
     @api.doc('list_promotions')
     @api.expect(promotion_args, validate=True)
-    @api.marshal_list_with(promotion_model)
+    @api.response(304, 'Promotions not modified since the ETag in If-None-Match')
+    @api.response(200, 'Success', [promotion_model])
+    @query_budget(3)
     def get(self):
         """ Returns all of the Promotions """
         app.logger.info("Request for promotion list")
@@ -192,27 +365,72 @@ class PromotionCollection(Resource):
         promotions = []
         args = promotion_args.parse_args()
         
-        if args['promotion_type']:
-            app.logger.info('Filtering by promotion type: %s', args['promotion_type'])
-            promotions = Promotion.find_by_promotiontype(args['promotion_type'])
-        elif args['active'] is not None:
-            app.logger.info('Filtering by active: %s', args['active'])
-            promotions = Promotion.find_by_active(args['active'])
-        elif args['title']:
-            app.logger.info('Filtering by title: %s', args['title'])
-            promotions = Promotion.find_by_title(args['title'])
-        elif args['end_date']:
-            app.logger.info('Filtering by end date: %s', args['end_date'])
-            promotions = Promotion.find_by_end_date(args['end_date'])
-        else:
-            app.logger.info('Returning unfiltered list.')
-            promotions = Promotion.all()
-            
-        
-        
-        results = [promotion.serialize() for promotion in promotions]
-        app.logger.info('[%s] Promotions returned', len(results))
-        return results, status.HTTP_200_OK
+        filters = promotion_filters(args)
+        app.logger.info('Filtering by: %s', filters)
+        promotions = Promotion.find_by_filters(**filters)
+
+        headers = {}
+        if args['total']:
+            headers['X-Total-Count'] = str(count_promotions(promotions, args['total'])[0])
+        stream = wants_stream(args)
+        sort, after = args['sort'], None
+        if args['cursor']:
+            sort, after = decode_cursor(args['cursor'])
+        fields = args['fields']
+        writer = serializer_for(fields)
+        if fields:
+            promotions = Promotion.project(promotions, fields, sort)
+        batch_size = app.config['STREAM_BATCH_SIZE']
+        if args['limit'] or args['cursor']:
+            limit = args['limit'] or DEFAULT_PAGE_SIZE
+            promotions, next_key = Promotion.find_page(limit, after, sort, promotions)
+            if next_key is not None:
+                next_cursor = encode_cursor(sort, next_key)
+                query = request.args.to_dict()
+                query.update(cursor=next_cursor, limit=limit)
+                query.pop('sort', None)
+                next_url = api.url_for(PromotionCollection, _external=True, **query)
+                headers['X-Next-Cursor'] = next_cursor
+                headers['Link'] = '<{}>; rel="next"'.format(next_url)
+        elif stream:
+            promotions = Promotion.stream(promotions, batch_size)
+
+        if stream:
+            app.logger.info('Streaming promotion list.')
+            return Response(
+                stream_with_context(ndjson_chunks(promotions, batch_size, writer)),
+                status=status.HTTP_200_OK,
+                mimetype=NDJSON_MIMETYPE,
+                headers=headers,
+            )
+
+        promotions = list(promotions)
+        etag = collection_etag(promotions)
+        headers['ETag'] = quote_etag(etag, weak=True)
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        app.logger.info('[%s] Promotions returned', len(promotions))
+        return Response(
+            writer.many(promotions),
+            status=status.HTTP_200_OK,
+            mimetype='application/json',
+            headers=headers,
+        )
+
+
+######################################################################
+# COUNT PROMOTIONS WITH HEAD
+######################################################################
+
+    @api.doc('count_promotions_head')
+    @api.expect(count_args, validate=True)
+    @api.response(200, 'The count is in X-Total-Count')
+    @query_budget(2)
+    def head(self):
+        """ Returns the number of Promotions matching the filters in X-Total-Count """
+        args = count_args.parse_args()
+        count, _ = count_promotions(Promotion.find_by_filters(**promotion_filters(args)), args['total'])
+        return Response(status=status.HTTP_200_OK, headers={'X-Total-Count': str(count)})
 
 
 ######################################################################
@@ -223,6 +441,7 @@ class PromotionCollection(Resource):
     @api.response(415, 'Invalid Content Type')
     @api.expect(create_model)
     @api.marshal_with(promotion_model, code=201)
+    @query_budget(2)
     def post(self):
         """
         Creates a Promotion
@@ -240,14 +459,213 @@ class PromotionCollection(Resource):
                 promotion.create()
             app.logger.info('Promotion with new id [%s] created!', promotion.id)
             location_url = api.url_for(PromotionResource, promotion_id=promotion.id, _external=True)
-            return promotion.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
+            headers = {'Location': location_url, 'ETag': quote_etag(promotion_etag(promotion))}
+            return promotion.serialize(), status.HTTP_201_CREATED, headers
         except Exception:
             api.abort(status.HTTP_400_BAD_REQUEST, 'Bad Request')
-        
-            
 
-        
-        
+######################################################################
+# DELETE PROMOTIONS BY FILTER
+######################################################################
+
+    @api.doc('delete_promotions_by_filter')
+    @api.expect(filter_args, validate=True)
+    @api.response(400, 'No filter was given')
+    @api.marshal_with(bulk_count_model)
+    @query_budget(1)
+    def delete(self):
+        """
+        Deletes every Promotion matching the filters
+        This endpoint deletes all of the selected Promotions with a single statement
+        """
+        filters = required_filters(filter_args.parse_args())
+        app.logger.info("Request to delete promotions matching %s", filters)
+        count = Promotion.delete_where(**filters)
+        app.logger.info("[%s] Promotions deleted", count)
+        return {'count': count}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /promotions/count
+######################################################################
+@api.route('/promotions/count')
+class PromotionCount(Resource):
+    """ The number of Promotions matching some filters """
+    @api.doc('count_promotions')
+    @api.expect(count_args, validate=True)
+    @api.marshal_with(count_model)
+    @query_budget(2)
+    def get(self):
+        """
+        Counts the Promotions matching the filters
+        Only a SELECT COUNT is run, no Promotions are loaded. With ?total=estimate
+        tables larger than COUNT_ESTIMATE_THRESHOLD rows are estimated instead.
+        """
+        args = count_args.parse_args()
+        filters = promotion_filters(args)
+        app.logger.info('Request to count promotions matching %s', filters)
+        count, estimated = count_promotions(Promotion.find_by_filters(**filters), args['total'])
+        return {'count': count, 'estimated': estimated}, status.HTTP_200_OK, {'X-Total-Count': str(count)}
+
+
+######################################################################
+#  PATH: /promotions/effective
+######################################################################
+@api.route('/promotions/effective')
+class EffectiveCollection(Resource):
+    """ Promotions in effect at a moment or during a window """
+    @api.doc('list_effective_promotions')
+    @api.expect(effective_args, validate=True)
+    @api.response(400, 'The window was not valid')
+    @api.marshal_list_with(promotion_model)
+    @query_budget(2)
+    def get(self):
+        """
+        Returns the Promotions in effect
+        With ?at= this returns the Promotions whose start and end dates include that
+        moment (now when it is omitted). With ?from= and ?to= it returns every Promotion
+        in effect at any time during that window.
+        """
+        args = effective_args.parse_args()
+        if args['from'] or args['to']:
+            if not (args['from'] and args['to']):
+                abort(status.HTTP_400_BAD_REQUEST, 'Both from and to are required')
+            app.logger.info('Request for promotions effective from %s to %s', args['from'], args['to'])
+            try:
+                promotions = Promotion.find_overlapping(args['from'], args['to'])
+            except DataValidationError as error:
+                abort(status.HTTP_400_BAD_REQUEST, str(error))
+        else:
+            at = args['at'] or datetime.utcnow()
+            app.logger.info('Request for promotions effective at %s', at)
+            promotions = Promotion.find_effective(at)
+        results = [promotion.serialize() for promotion in promotions]
+        app.logger.info('[%s] Promotions returned', len(results))
+        return results, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /promotions/search
+######################################################################
+@api.route('/promotions/search')
+class SearchCollection(Resource):
+    """ Promotions matching a search box """
+    @api.doc('search_promotions')
+    @api.expect(search_args, validate=True)
+    @api.marshal_list_with(search_result_model)
+    @query_budget(3)
+    def get(self):
+        """
+        Searches the Promotions by title and type
+        This returns the Promotions with a title or type word starting with, or
+        spelled close to, each word of q, the most similar first.
+        """
+        args = search_args.parse_args()
+        app.logger.info('Request to search promotions for %s', args['q'])
+        results = [
+            dict(promotion.serialize(), score=round(score, 3))
+            for promotion, score in Promotion.search(args['q'], args['limit'])
+        ]
+        app.logger.info('[%s] Promotions returned', len(results))
+        return results, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /promotions/export
+######################################################################
+@api.route('/promotions/export')
+class ExportCollection(Resource):
+    """ Every matching Promotion as one file """
+    @api.doc('export_promotions')
+    @api.expect(export_args, validate=True)
+    @api.response(200, 'A CSV or newline delimited JSON file, streamed')
+    @query_budget(1)
+    def get(self):
+        """
+        Exports the Promotions
+        This streams every Promotion matching the filters, ordered by id, as CSV or
+        newline delimited JSON. The rows are read from the database and encoded in
+        batches so that memory use does not depend on the number of Promotions.
+        """
+        args = export_args.parse_args()
+        filters = promotion_filters(args)
+        fields = args['fields'] or PROMOTION_FIELDS
+        app.logger.info('Request to export promotions as %s filtered by %s', args['format'], filters)
+        rows = Promotion.export(
+            Promotion.find_by_filters(**filters), fields, app.config['EXPORT_BATCH_SIZE']
+        )
+        if args['format'] == 'csv':
+            writer = CsvSerializer(fields, positional=True)
+            chunks = itertools.chain([writer.header()], export_chunks(rows, writer))
+        else:
+            writer = PromotionSerializer(fields, dumps=serializer.dumps, positional=True)
+            chunks = export_chunks(rows, writer)
+        headers = {
+            'Content-Disposition': 'attachment; filename="promotions.{}"'.format(args['format']),
+        }
+        if args['compress'] == 'gzip':
+            chunks = gzip_chunks(chunks, app.config['EXPORT_GZIP_LEVEL'])
+            headers['Content-Encoding'] = 'gzip'
+        return Response(
+            stream_with_context(chunks),
+            status=status.HTTP_200_OK,
+            mimetype=EXPORT_MIMETYPES[args['format']],
+            headers=headers,
+        )
+
+
+######################################################################
+#  PATH: /promotions/bulk
+######################################################################
+@api.route('/promotions/bulk')
+class PromotionBulkResource(Resource):
+    """ Creates many Promotions in one request """
+    @api.doc('create_promotions_bulk')
+    @api.response(400, 'The posted data was not valid')
+    @api.response(207, 'Some of the Promotions were not created', bulk_result_model)
+    @api.response(415, 'Invalid Content Type')
+    @api.expect([create_model])
+    @api.marshal_with(bulk_result_model, code=201)
+    def post(self):
+        """
+        Creates many Promotions
+        This endpoint accepts a JSON array, or newline delimited JSON, of Promotions
+        and inserts them in batches. Promotions that are not valid are reported
+        by their position in the request and do not stop the others.
+        """
+        app.logger.info("Request to bulk create promotions")
+        items = bulk_payload()
+        indexes, promotions, errors = [], [], []
+        for index, data in enumerate(items):
+            try:
+                promotions.append(Promotion().deserialize(data))
+                indexes.append(index)
+            except DataValidationError as error:
+                errors.append({'index': index, 'error': str(error)})
+
+        ids = []
+        batch_size = app.config['BULK_BATCH_SIZE']
+        results = Promotion.create_many(promotions, batch_size)
+        for index, result in zip(indexes, results):
+            if isinstance(result, DataValidationError):
+                errors.append({'index': index, 'error': str(result)})
+            else:
+                ids.append(result)
+        # one INSERT per batch, and one per row when the database rejected
+        # a batch and its rows were retried one at a time
+        batches = -(-len(promotions) // batch_size)
+        set_query_budget(batches + (len(promotions) if len(ids) < len(promotions) else 0))
+        errors.sort(key=lambda error: error['index'])
+
+        app.logger.info('[%s] Promotions created, [%s] rejected', len(ids), len(errors))
+        if not errors:
+            code = status.HTTP_201_CREATED
+        elif ids:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return {'ids': ids, 'errors': errors}, code
+
 
 ######################################################################
 #  PATH: /promotions/{id}/activate
@@ -257,29 +675,18 @@ class PromotionCollection(Resource):
 class ActivateResource(Resource):
     """ Activate actions on a Promotion """ 
     @api.response(404, 'Promotion not found')
-    @api.response(400, 'The posted Promotion data was not valid')
-    @api.expect(promotion_model)
     @api.marshal_with(promotion_model)
     @api.doc('activate_promotions')
+    @query_budget(1, without_returning=2)
     def put(self, promotion_id):
-       
+        """
+        Activate a Promotion
+        This endpoint activates a Promotion with a single UPDATE statement
+        """
         app.logger.info("Request to activate promotion with id: %s", promotion_id)
-        # check_content_type("application/json")
-        try:
-            val=int(promotion_id)
-            promotion = Promotion.find(promotion_id)
-            promotion.update()
-            promotion.active = True
-            app.logger.info("Promotion with ID [%s] has been activated!", promotion.id)
-            return promotion.serialize(), status.HTTP_200_OK
-        except Exception:
-            raise NotFound(
-            "Promotion with id '{}' was not found.".format(promotion_id))
-        
-            
-        
-        
-
+        promotion = set_active_or_404(promotion_id, True)
+        app.logger.info("Promotion with ID [%s] has been activated!", promotion.id)
+        return promotion.serialize(), status.HTTP_200_OK, {'ETag': quote_etag(promotion_etag(promotion))}
 
 
 ######################################################################
@@ -292,19 +699,65 @@ class DeactivateResource(Resource):
     @api.response(404, 'Promotion not found')
     @api.marshal_with(promotion_model)
     @api.doc('deactivate_promotions')
+    @query_budget(1, without_returning=2)
     def put(self, promotion_id):
+        """
+        Deactivate a Promotion
+        This endpoint deactivates a Promotion with a single UPDATE statement
+        """
         app.logger.info(
             "Request to deactivate promotion with id: %s", promotion_id)
-        try:
-            val=int(promotion_id)
-            promotion = Promotion.find(promotion_id)
-            promotion.update()
-            promotion.active = False
-            app.logger.info("Promotion with ID [%s] has been activated!", promotion.id)
-            return promotion.serialize(), status.HTTP_200_OK
-        except Exception:
-            raise NotFound(
-            "Promotion with id '{}' was not found.".format(promotion_id))
+        promotion = set_active_or_404(promotion_id, False)
+        app.logger.info("Promotion with ID [%s] has been deactivated!", promotion.id)
+        return promotion.serialize(), status.HTTP_200_OK, {'ETag': quote_etag(promotion_etag(promotion))}
+
+
+######################################################################
+#  PATH: /promotions/activate
+######################################################################
+@api.route('/promotions/activate')
+class BulkActivateResource(Resource):
+    """ Activate every Promotion matching a filter """
+    @api.doc('activate_promotions_by_filter')
+    @api.expect(filter_args, validate=True)
+    @api.response(400, 'No filter was given')
+    @api.marshal_with(bulk_count_model)
+    @query_budget(1)
+    def put(self):
+        """
+        Activates every Promotion matching the filters
+        This endpoint updates all of the selected Promotions with a single statement
+        """
+        filters = required_filters(filter_args.parse_args())
+        app.logger.info("Request to activate promotions matching %s", filters)
+        count = Promotion.set_active_where(True, **filters)
+        app.logger.info("[%s] Promotions activated", count)
+        return {'count': count}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /promotions/deactivate
+######################################################################
+@api.route('/promotions/deactivate')
+class BulkDeactivateResource(Resource):
+    """ Deactivate every Promotion matching a filter """
+    @api.doc('deactivate_promotions_by_filter')
+    @api.expect(filter_args, validate=True)
+    @api.response(400, 'No filter was given')
+    @api.marshal_with(bulk_count_model)
+    @query_budget(1)
+    def put(self):
+        """
+        Deactivates every Promotion matching the filters
+        This endpoint updates all of the selected Promotions with a single statement
+        """
+        filters = required_filters(filter_args.parse_args())
+        app.logger.info("Request to deactivate promotions matching %s", filters)
+        count = Promotion.set_active_where(False, **filters)
+        app.logger.info("[%s] Promotions deactivated", count)
+        return {'count': count}, status.HTTP_200_OK
+
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
@@ -323,12 +776,185 @@ def data_load(payload):
 
 
 
+def promotion_filters(args):
+    """ Returns the filters from the parsed promotion_args that were given """
+    return {
+        name: args[name]
+        for name in Promotion.FILTERS
+        if args.get(name) is not None
+    }
+
+
+def set_active_or_404(promotion_id, active):
+    """ Sets the active flag of a Promotion, or aborts with 404 if it does not exist """
+    promotion = None
+    if str(promotion_id).isdigit():
+        promotion = Promotion.set_active(int(promotion_id), active)
+    if promotion is None:
+        raise NotFound(
+            "Promotion with id '{}' was not found.".format(promotion_id))
+    return promotion
+
+
+def count_promotions(query, total):
+    """ Counts the Promotions of a query exactly, or estimates large counts
+    when total is 'estimate' """
+    estimate_over = app.config['COUNT_ESTIMATE_THRESHOLD'] if total == 'estimate' else None
+    return Promotion.count(query, estimate_over)
+
+
+def promotion_etag(promotion):
+    """ Returns the strong ETag of a Promotion, made of its id and version """
+    return '{}-{}'.format(promotion.id, promotion.version)
+
+
+def etag_version(etags, promotion_id):
+    """ Returns the version from the ETag in etags that belongs to the Promotion """
+    for etag in etags.as_set():
+        tag_id, _, version = etag.partition('-')
+        if tag_id == str(promotion_id) and version.isdigit():
+            return int(version)
+    return None
+
+
+def collection_etag(rows):
+    """ Returns an ETag for a listing that changes whenever any of its rows do
+
+    It hashes the (id, version) pairs of the rows that were fetched for the
+    response together with the query string, so paging and filter arguments
+    get their own tags and no extra query is needed.
+    """
+    digest = hashlib.sha1(repr(sorted(request.args.items(multi=True))).encode('utf-8'))
+    for row in rows:
+        digest.update(b'%d-%d,' % (row.id, row.version))
+    return digest.hexdigest()
+
+
+def required_filters(args):
+    """ Returns the given filters, aborting when there are none
+
+    Set based updates and deletes must be scoped so that a missing query
+    string can never change every Promotion in the table.
+    """
+    filters = promotion_filters(args)
+    if not filters:
+        abort(status.HTTP_400_BAD_REQUEST, 'At least one filter is required')
+    return filters
+
+
+def bulk_payload():
+    """ Returns the list of Promotion payloads posted to a bulk endpoint
+
+    The body is either a JSON array or newline delimited JSON. Lines that are
+    not valid JSON are returned as None so they are reported as bad data.
+    """
+    if request.mimetype == NDJSON_MIMETYPE:
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+    check_content_type("application/json")
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        abort(status.HTTP_400_BAD_REQUEST, 'Request body must be a JSON array of Promotions')
+    return items
+
+
+def wants_stream(args):
+    """ Checks if the client asked for a streamed listing """
+    if args['stream'] is not None:
+        return args['stream']
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def serializer_for(fields):
+    """ Returns the serializer that writes only the given fields, or all of them """
+    if not fields:
+        return serializer
+    return PromotionSerializer(fields, dumps=serializer.dumps)
+
+
+def ndjson_chunks(promotions, batch_size, writer=serializer):
+    """ Encodes Promotions as newline delimited JSON, one chunk per batch """
+    count = 0
+    promotions = iter(promotions)
+    while True:
+        batch = list(itertools.islice(promotions, batch_size))
+        if not batch:
+            break
+        count += len(batch)
+        yield writer.lines(batch)
+    app.logger.info('[%s] Promotions streamed', count)
+
+
+def export_chunks(batches, writer):
+    """ Encodes batches of exported rows, one chunk per batch """
+    count = 0
+    for rows in batches:
+        count += len(rows)
+        yield writer.lines(rows)
+    app.logger.info('[%s] Promotions exported', count)
+
+
+def gzip_chunks(chunks, level):
+    """ Compresses chunks into one gzip stream as they are produced """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def encode_cursor(sort, key):
+    """ Encodes a page sort key into an opaque url safe cursor """
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in key]
+    raw = json.dumps([sort] + values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Decodes a cursor from encode_cursor() back into (sort, key) """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort, *values = json.loads(raw.decode('utf-8'))
+        columns = Promotion.SORT_KEYS[sort]
+        if len(values) != len(columns):
+            raise ValueError('cursor does not match sort key')
+        key = tuple(
+            int(value) if name == 'id' else datetime.fromisoformat(value)
+            for name, value in zip(columns, values)
+        )
+    except (ValueError, TypeError, KeyError, UnicodeDecodeError) as error:
+        app.logger.error('Invalid cursor [%s]: %s', cursor, error)
+        abort(status.HTTP_400_BAD_REQUEST, 'Invalid cursor')
+    return sort, key
+
+
 def init_db():
-    """ Initialies the SQLAlchemy app """
+    """ Initialies the SQLAlchemy app, no connection is made until first use """
     global app
     Promotion.init_db(app)
 
 
+@app.teardown_request
+def remove_session(error=None):
+    """ Ends the request's database session
+
+    Promotion.init_db leaves an app context pushed for the scripts and
+    shells, and requests reuse it instead of pushing their own, so the
+    teardown_appcontext of Flask-SQLAlchemy never runs for them. Without
+    this every request of a worker thread would share one session.
+    """
+    db.session.remove()
+
+
 def check_content_type(content_type):
     """ Checks that the media type is correct """
     if "Content-Type" in request.headers and request.headers["Content-Type"] == content_type:
@@ -0,0 +1,184 @@
+######################################################################
+# Promotion Scheduler
+######################################################################
+"""
+Activates and expires the Promotions as their dates pass
+
+Every run flips ``active`` with set-based UPDATEs, in batches of
+SCHEDULER_BATCH_SIZE rows:
+
+* Promotions whose start_date has passed and that are still running are
+  activated
+* Promotions whose end_date has passed are deactivated
+
+A watermark table remembers the moment the last run processed the dates up
+to, so a run only touches the rows whose start or end was crossed since
+then, using the start_date and (active, end_date) indexes. Promotions
+written since then that have already ended are expired as well. The first
+run, without a watermark, brings every Promotion in line with its dates.
+
+After that a start is only acted on when it is crossed: a Promotion
+deactivated by hand while it is running stays inactive, and so does one
+created or updated inactive with a start_date already past the watermark,
+since every write states active explicitly.
+
+It runs either inside the service, when SCHEDULER_ENABLED starts a
+PromotionScheduler thread in every gunicorn worker, or on its own:
+
+    python -m service.scheduler --once
+    python -m service.scheduler --interval 60
+
+On PostgreSQL a run first takes an advisory lock, so whichever worker or
+process gets it runs while the others skip, and a run is skipped when the
+watermark is younger than half the interval, so the workers do not repeat
+each other's run.
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from service.models import db, Promotion, Watermark
+from service.metrics import SCHEDULER_DURATION, SCHEDULER_PROMOTIONS, SCHEDULER_RUNS, SCHEDULER_WATERMARK
+from . import app
+
+logger = logging.getLogger("flask.app")
+
+# name of the watermark row of the scheduler
+WATERMARK_NAME = "promotion-scheduler"
+# PostgreSQL advisory lock key, taken by the process that runs
+ADVISORY_LOCK_KEY = 0x70726F6D
+
+
+class PromotionScheduler:
+    """
+    Runs the activations and expirations every ``interval`` seconds
+    """
+
+    def __init__(self, interval=60.0, batch_size=1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, now=None, min_age=0.0):
+        """Activates and expires the Promotions whose dates were crossed
+
+        Args:
+            now (datetime): the moment to process the dates up to, in UTC
+            min_age (float): skip the run when the watermark is younger
+
+        Returns:
+            a dict with the counts of the run, or None when it was skipped
+        """
+        now = now or datetime.utcnow()
+        connection = None
+        if db.engine.dialect.name == "postgresql":
+            # session level lock, held on a connection of its own while the
+            # batches are committed on the session's
+            connection = db.engine.connect()
+            if not connection.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_KEY,)).scalar():
+                connection.close()
+                SCHEDULER_RUNS.labels("locked").inc()
+                return None
+        try:
+            return self._run(now, min_age)
+        except Exception:
+            db.session.rollback()
+            SCHEDULER_RUNS.labels("failed").inc()
+            raise
+        finally:
+            if connection is not None:
+                connection.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+                connection.close()
+
+    def _run(self, now, min_age):
+        since = Watermark.get(WATERMARK_NAME)
+        if since is not None and (now - since).total_seconds() < min_age:
+            db.session.rollback()
+            SCHEDULER_RUNS.labels("fresh").inc()
+            return None
+        started = time.perf_counter()
+        activated = Promotion.activate_started(since, now, self.batch_size)
+        expired = Promotion.expire_ended(since, now, self.batch_size)
+        Watermark.advance(WATERMARK_NAME, now)
+        elapsed = time.perf_counter() - started
+        SCHEDULER_RUNS.labels("completed").inc()
+        SCHEDULER_PROMOTIONS.labels("activated").inc(activated)
+        SCHEDULER_PROMOTIONS.labels("expired").inc(expired)
+        SCHEDULER_DURATION.observe(elapsed)
+        SCHEDULER_WATERMARK.set(now.replace(tzinfo=timezone.utc).timestamp())
+        self.last_run = {
+            "since": since.isoformat() if since else None,
+            "until": now.isoformat(),
+            "activated": activated,
+            "expired": expired,
+            "seconds": round(elapsed, 6),
+        }
+        logger.info("Scheduler activated %s and expired %s Promotions in %.1f ms",
+                    activated, expired, elapsed * 1000)
+        return self.last_run
+
+    def run_forever(self):
+        """Runs now and then every interval until stop() is called"""
+        while True:
+            try:
+                with app.app_context():
+                    self.run_once(min_age=self.interval / 2)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Scheduler run failed")
+            finally:
+                db.session.remove()
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        """Runs the scheduler on a daemon thread"""
+        logger.info("Starting the promotion scheduler every %s seconds", self.interval)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="promotion-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the thread after the run in progress"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def from_config():
+    """Returns a PromotionScheduler set up from the app's configuration"""
+    return PromotionScheduler(app.config["SCHEDULER_INTERVAL"], app.config["SCHEDULER_BATCH_SIZE"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--once", action="store_true", help="run once and exit")
+    parser.add_argument("--interval", type=float, default=app.config["SCHEDULER_INTERVAL"],
+                        help="seconds between runs")
+    parser.add_argument("--batch-size", type=int, default=app.config["SCHEDULER_BATCH_SIZE"],
+                        help="rows per UPDATE")
+    args = parser.parse_args(argv)
+
+    scheduler = PromotionScheduler(args.interval, args.batch_size)
+    while True:
+        try:
+            run = scheduler.run_once(min_age=0 if args.once else args.interval / 2)
+            print(json.dumps(run or {"skipped": True}), flush=True)
+        except Exception as error:  # pylint: disable=broad-except
+            print("Scheduler run failed: {}".format(error), file=sys.stderr, flush=True)
+            if args.once:
+                return 1
+        finally:
+            db.session.remove()
+        if args.once:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Text search index for the Promotion Service
+
+NgramIndex - an in-memory trigram index over short texts, such as the
+titles and promotion types of the Promotions, that answers prefix and typo
+tolerant queries ranked by similarity. It is used when the database cannot
+search itself, PostgreSQL without the pg_trgm extension or SQLite.
+
+Texts are split into lower case words and every word into trigrams the
+way pg_trgm does it, padded with two spaces in front and one behind. Each
+word of a query is matched to the word of a text that shares most of its
+trigrams, or that it is a prefix of, and the similarity of the text is the
+share of the query's trigrams matched that way. It is close to pg_trgm's
+word_similarity(), and a text with a word starting with every word of the
+query scores 1.0.
+"""
+import re
+import math
+import heapq
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def words(text):
+    """ Returns the lower case words of a text """
+    return WORD.findall(text.lower())
+
+
+def trigrams(word):
+    """ Returns the set of padded trigrams of a word """
+    padded = "  " + word + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NgramIndex:
+    """
+    Trigram index over the words of keyed documents
+
+    Each document has a few texts, e.g. (title, promotion_type). Trigrams
+    point at distinct words and words at the distinct texts that use them,
+    and each text keeps the sorted keys of its documents. A catalog with
+    many Promotions under the same title costs no more to search than one.
+    A sorted list of the words answers prefix queries by bisection, like a
+    trie would.
+    """
+
+    def __init__(self, documents=None):
+        self._texts_by_key = {}  # key -> tuple of lower case texts
+        self._keys = {}  # text -> sorted keys
+        self._texts = {}  # word -> texts using it
+        self._grams = {}  # word -> its trigrams
+        self._postings = defaultdict(set)  # trigram -> words
+        self._sorted = []  # sorted words
+        if documents:
+            self._build(documents)
+
+    def __len__(self):
+        return len(self._texts_by_key)
+
+    def __contains__(self, key):
+        return key in self._texts_by_key
+
+    def _add_text(self, text):
+        """ Indexes the words of a new text """
+        self._keys[text] = []
+        for word in set(words(text)):
+            texts = self._texts.get(word)
+            if texts is None:
+                texts = self._texts[word] = set()
+                self._grams[word] = trigrams(word)
+                for gram in self._grams[word]:
+                    self._postings[gram].add(word)
+                insort(self._sorted, word)
+            texts.add(text)
+
+    def _remove_text(self, text):
+        """ Drops a text that no document has any more """
+        del self._keys[text]
+        for word in set(words(text)):
+            texts = self._texts[word]
+            texts.discard(text)
+            if not texts:
+                del self._texts[word]
+                for gram in self._grams.pop(word):
+                    self._postings[gram].discard(word)
+                    if not self._postings[gram]:
+                        del self._postings[gram]
+                del self._sorted[bisect_left(self._sorted, word)]
+
+    def _build(self, documents):
+        """ Indexes many documents, sorting the keys once at the end """
+        for key, *texts in documents:
+            lowered = tuple({text.lower() for text in texts if text})
+            self._texts_by_key[key] = lowered
+            for text in lowered:
+                if text not in self._keys:
+                    self._add_text(text)
+                self._keys[text].append(key)
+        for keys in self._keys.values():
+            keys.sort()
+
+    def add(self, key, *texts):
+        """ Adds or replaces the texts of a document """
+        self.remove(key)
+        lowered = tuple({text.lower() for text in texts if text})
+        self._texts_by_key[key] = lowered
+        for text in lowered:
+            if text not in self._keys:
+                self._add_text(text)
+            keys = self._keys[text]
+            if not keys or keys[-1] < key:
+                keys.append(key)  # new ids are usually the highest
+            else:
+                insort(keys, key)
+
+    def remove(self, key):
+        """ Removes a document, if it is indexed """
+        for text in self._texts_by_key.pop(key, ()):
+            keys = self._keys[text]
+            del keys[bisect_left(keys, key)]
+            if not keys:
+                self._remove_text(text)
+
+    def _similar_words(self, word, threshold):
+        """ Returns {word: shared trigrams} for the indexed words like word """
+        grams = trigrams(word)
+        # a word sharing `needed` trigrams must have one of the rarest
+        # len(grams) - needed + 1 of them, so only those words are compared
+        needed = max(1, math.ceil(threshold * len(grams) - 1e-9))
+        rarest = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))
+        similar = {}
+        for gram in rarest[:len(grams) - needed + 1]:
+            for candidate in self._postings.get(gram, ()):
+                if candidate not in similar:
+                    shared = len(grams & self._grams[candidate])
+                    similar[candidate] = shared if shared >= needed else 0
+        position, ordered = bisect_left(self._sorted, word), self._sorted
+        while position < len(ordered) and ordered[position].startswith(word):
+            similar[ordered[position]] = len(grams)
+            position += 1
+        return {candidate: shared for candidate, shared in similar.items() if shared}
+
+    def scores(self, query, threshold=0.6):
+        """ Returns {text: similarity} for the texts that match a query """
+        query_words = words(query)
+        total = sum(len(trigrams(word)) for word in query_words)
+        matched = defaultdict(int)
+        for word in query_words:
+            best = {}
+            for candidate, shared in self._similar_words(word, threshold).items():
+                for text in self._texts[candidate]:
+                    if shared > best.get(text, 0):
+                        best[text] = shared
+            for text, shared in best.items():
+                matched[text] += shared
+        return {
+            text: shared / total for text, shared in matched.items() if shared / total >= threshold
+        }
+
+    def _ranked_texts(self, query, threshold):
+        """ Returns {score: [texts]} for the texts that match a query """
+        query_words = words(query)
+        by_score = defaultdict(list)
+        if len(query_words) == 1:
+            # every text scores like its best word, no need to add them up
+            word = query_words[0]
+            total = len(trigrams(word))
+            seen = set()
+            similar = self._similar_words(word, threshold)
+            for candidate in sorted(similar, key=similar.get, reverse=True):
+                texts = self._texts[candidate] - seen
+                seen.update(texts)
+                by_score[similar[candidate] / total].extend(texts)
+            return by_score
+        for text, score in self.scores(query, threshold).items():
+            by_score[score].append(text)
+        return by_score
+
+    def search(self, query, limit=10, threshold=0.6):
+        """ Returns up to limit (score, key) pairs, best first then by key
+
+        A document scores the best similarity of its texts.
+        """
+        by_score = self._ranked_texts(query, threshold)
+        results, seen = [], set()
+        for score in sorted(by_score, reverse=True):
+            # merged lazily, so only the lowest keys of the texts are read
+            # even when those already returned at a better score are skipped
+            for key in heapq.merge(*(self._keys[text] for text in by_score[score])):
+                if key not in seen:
+                    seen.add(key)
+                    results.append((score, key))
+                    if len(results) == limit:
+                        return results
+        return results
@@ -0,0 +1,167 @@
+"""
+Fast serializers for the Promotion Service
+
+PromotionSerializer turns Promotions (or projected rows) straight into JSON
+bytes. The function that builds each dictionary is compiled once per set
+of fields, datetimes are formatted through a cache, and the JSON encoder
+is pluggable so that orjson is used when it is installed.
+
+CsvSerializer writes the same fields as CSV lines for the bulk export.
+"""
+import io
+import csv
+import json
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# Fields of a Promotion in the order they are emitted
+PROMOTION_FIELDS = ("id", "title", "promotion_type", "start_date", "end_date", "active")
+
+# Fields that hold datetimes and are emitted as ISO 8601 strings
+DATETIME_FIELDS = frozenset(("start_date", "end_date", "updated_at"))
+
+
+@lru_cache(maxsize=4096)
+def format_datetime(value):
+    """Formats a datetime as ISO 8601 the way flask_restx fields.DateTime does.
+    Promotions share few distinct dates, so the cache hit rate is high."""
+    if value is None or isinstance(value, str):
+        return value
+    return value.isoformat()
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+JSON_BACKENDS = {"json": _json_dumps}
+if orjson is not None:
+    JSON_BACKENDS["orjson"] = orjson.dumps
+
+
+def json_backend(name="auto"):
+    """Returns the function that encodes objects to JSON bytes
+
+    Args:
+        name (string): "json", "orjson" or "auto" for the fastest installed
+    """
+    if name == "auto":
+        name = "orjson" if "orjson" in JSON_BACKENDS else "json"
+    if name not in JSON_BACKENDS:
+        raise ValueError("Unknown or unavailable JSON backend: " + name)
+    return JSON_BACKENDS[name]
+
+
+def format_boolean(value):
+    """Formats a boolean the way JSON does"""
+    return "true" if value else "false"
+
+
+def _reader(name, position, positional):
+    """Returns the expression that reads a field from a row"""
+    if not name.isidentifier():
+        raise ValueError("Invalid field name: " + name)
+    return "row[{}]".format(position) if positional else "row.{}".format(name)
+
+
+@lru_cache(maxsize=64)
+def _compile(fields, positional=False):
+    """Compiles a function that maps a row to a dict of the given fields
+
+    The generated function reads each attribute directly instead of
+    walking field definitions on every call the way marshal() does. With
+    positional it reads tuples holding the fields in order instead.
+    """
+    items = []
+    for position, name in enumerate(fields):
+        value = _reader(name, position, positional)
+        if name in DATETIME_FIELDS:
+            value = "format_datetime({})".format(value)
+        items.append("{!r}: {}".format(name, value))
+    source = "def to_dict(row):\n    return {" + ", ".join(items) + "}\n"
+    namespace = {"format_datetime": format_datetime}
+    exec(compile(source, "<serializer {}>".format(",".join(fields)), "exec"), namespace)
+    return namespace["to_dict"]
+
+
+class PromotionSerializer:
+    """
+    Serializes Promotions, or rows with the same attributes, to JSON
+
+    Args:
+        fields (tuple): the fields to emit, defaults to every Promotion field
+        dumps (callable): encodes an object to JSON bytes, see json_backend()
+        positional (bool): rows are tuples of the fields in order
+    """
+
+    def __init__(self, fields=PROMOTION_FIELDS, dumps=None, positional=False):
+        self.fields = tuple(fields)
+        self.to_dict = _compile(self.fields, positional)
+        self.dumps = dumps or json_backend()
+
+    def one(self, row):
+        """Returns a single row as JSON bytes"""
+        return self.dumps(self.to_dict(row))
+
+    def many(self, rows):
+        """Returns a JSON array of the rows as bytes"""
+        to_dict = self.to_dict
+        return self.dumps([to_dict(row) for row in rows])
+
+    def lines(self, rows):
+        """Returns the rows as newline delimited JSON bytes"""
+        to_dict, dumps = self.to_dict, self.dumps
+        return b"".join(dumps(to_dict(row)) + b"\n" for row in rows)
+
+
+@lru_cache(maxsize=64)
+def _compile_values(fields, positional=False):
+    """Compiles a function that maps a row to a tuple of CSV values
+
+    Datetimes are written as ISO 8601 and booleans as true or false, like
+    in the JSON documents.
+    """
+    items = []
+    for position, name in enumerate(fields):
+        value = _reader(name, position, positional)
+        if name in DATETIME_FIELDS:
+            value = "format_datetime({})".format(value)
+        elif name == "active":
+            value = "format_boolean({})".format(value)
+        items.append(value)
+    source = "def to_values(row):\n    return (" + "".join(item + ", " for item in items) + ")\n"
+    namespace = {"format_datetime": format_datetime, "format_boolean": format_boolean}
+    exec(compile(source, "<csv serializer {}>".format(",".join(fields)), "exec"), namespace)
+    return namespace["to_values"]
+
+
+class CsvSerializer:
+    """
+    Serializes Promotions, or rows with the same attributes, to CSV
+
+    Args:
+        fields (tuple): the columns to write, defaults to every Promotion field
+        positional (bool): rows are tuples of the fields in order
+    """
+
+    def __init__(self, fields=PROMOTION_FIELDS, positional=False):
+        self.fields = tuple(fields)
+        self.to_values = _compile_values(self.fields, positional)
+
+    def header(self):
+        """Returns the line with the column names as bytes"""
+        return self._write([self.fields])
+
+    def lines(self, rows):
+        """Returns one CSV line per row as bytes"""
+        return self._write(map(self.to_values, rows))
+
+    @staticmethod
+    def _write(values):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(values)
+        return buffer.getvalue().encode("utf-8")
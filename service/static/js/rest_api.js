@@ -249,6 +249,39 @@ $(function () {
         clear_form_data()
     });
 
+    // ****************************************
+    // Suggest titles while typing
+    // ****************************************
+
+    var suggest_timer = null;
+
+    $("#promotion_title").on("input", function () {
+        var text = $(this).val();
+        clearTimeout(suggest_timer);
+        if (text.length < 2) {
+            $("#promotion_title_suggestions").empty();
+            return;
+        }
+        // wait for a pause in typing rather than query on every key
+        suggest_timer = setTimeout(function () {
+            $.ajax({
+                type: "GET",
+                url: "/promotions/search?limit=10&q=" + encodeURIComponent(text),
+                contentType: "application/json",
+                data: ''
+            }).done(function(res){
+                var titles = [];
+                $("#promotion_title_suggestions").empty();
+                for (var i = 0; i < res.length; i++) {
+                    if (titles.indexOf(res[i].title) == -1) {
+                        titles.push(res[i].title);
+                        $("#promotion_title_suggestions").append($("<option>").attr("value", res[i].title));
+                    }
+                }
+            });
+        }, 150);
+    });
+
     // ****************************************
     // Search for a Promotion
     // ****************************************
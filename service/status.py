@@ -18,6 +18,7 @@ HTTP_203_NON_AUTHORITATIVE_INFORMATION = 203
 HTTP_204_NO_CONTENT = 204
 HTTP_205_RESET_CONTENT = 205
 HTTP_206_PARTIAL_CONTENT = 206
+HTTP_207_MULTI_STATUS = 207  # RFC 4918
 
 # Redirection - 3xx
 HTTP_300_MULTIPLE_CHOICES = 300
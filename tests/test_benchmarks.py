@@ -0,0 +1,69 @@
+"""
+Test cases for the benchmark tooling
+Test cases can be run with:
+    nosetests
+    coverage report -m
+While debugging just these tests it's convinient to use this:
+    nosetests --stop tests/test_benchmarks.py:TestHotpaths
+"""
+import io
+import unittest
+from contextlib import redirect_stdout
+from benchmarks.hotpaths import compare, measure
+from benchmarks.loadtest import parse_mix, percentile, summarize
+
+
+def results(**medians):
+    """ Builds benchmark results with the given medians """
+    return {"results": {name: {"median_us": value} for name, value in medians.items()}}
+
+
+######################################################################
+#  H O T   P A T H   B E N C H M A R K   T E S T   C A S E S
+######################################################################
+
+
+class TestHotpaths(unittest.TestCase):
+    """ Test Cases for the hot path benchmarks """
+
+    def test_measure(self):
+        """ Time a function """
+        timing = measure(lambda: None, repeat=2, budget=0.01)
+        self.assertGreater(timing["calls"], 0)
+        self.assertLessEqual(timing["min_us"], timing["median_us"])
+
+    def test_compare(self):
+        """ Flag only benchmarks that slowed down past the threshold """
+        baseline = results(fast=10.0, steady=10.0, slow=10.0)
+        current = results(fast=5.0, steady=11.0, slow=13.0, new=1.0)
+        with redirect_stdout(io.StringIO()) as output:
+            regressions = compare(baseline, current, threshold=0.2)
+        self.assertEqual(regressions, ["slow"])
+        self.assertIn("REGRESSION", output.getvalue())
+        self.assertIn("new", output.getvalue())
+
+
+######################################################################
+#  L O A D   T E S T   T E S T   C A S E S
+######################################################################
+
+
+class TestLoadtest(unittest.TestCase):
+    """ Test Cases for the load test harness """
+
+    def test_parse_mix(self):
+        """ Parse a weighted request mix """
+        self.assertEqual(parse_mix("get=3,list"), (["get", "list"], [3.0, 1.0]))
+        self.assertRaises(ValueError, parse_mix, "get=1,explode=2")
+
+    def test_summarize(self):
+        """ Report throughput and latency percentiles """
+        latencies = [i / 1000 for i in range(1, 101)]
+        self.assertEqual(percentile(latencies, 0.5), 0.05)
+        self.assertEqual(percentile([], 0.5), 0.0)
+        summary = summarize(latencies, 2, duration=10)
+        self.assertEqual(summary["requests"], 100)
+        self.assertEqual(summary["rps"], 10.0)
+        self.assertEqual(summary["p95_ms"], 95.0)
+        self.assertEqual(summary["p99_ms"], 99.0)
+        self.assertEqual(summary["max_ms"], 100.0)
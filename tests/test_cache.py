@@ -0,0 +1,77 @@
+"""
+Test cases for the LRU cache
+Test cases can be run with:
+    nosetests
+    coverage report -m
+While debugging just these tests it's convinient to use this:
+    nosetests --stop tests/test_cache.py:TestLRUCache
+"""
+import unittest
+from service.cache import LRUCache
+
+
+class FakeClock:
+    """ A clock that only moves when told to """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+
+
+class TestLRUCache(unittest.TestCase):
+    """ Test Cases for LRUCache """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LRUCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_and_set(self):
+        """ Store and read back a value """
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, "one")
+        self.assertEqual(self.cache.get(1), "one")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """ Evict the least recently used entry when full """
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.get(1)
+        self.cache.set(3, "three")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), "one")
+        self.assertEqual(self.cache.get(3), "three")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_entries_expire(self):
+        """ Expire entries after their time to live """
+        self.cache.set(1, "one")
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get(1), "one")
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_and_clear(self):
+        """ Remove entries on demand """
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.invalidate(1)
+        self.cache.invalidate(5)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), "two")
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_bad_size(self):
+        """ Refuse a cache that cannot hold anything """
+        self.assertRaises(ValueError, LRUCache, 0)
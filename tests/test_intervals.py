@@ -0,0 +1,86 @@
+"""
+Test cases for the interval tree
+Test cases can be run with:
+    nosetests
+    coverage report -m
+While debugging just these tests it's convinient to use this:
+    nosetests --stop tests/test_intervals.py:TestIntervalTree
+"""
+import random
+import unittest
+from datetime import datetime, timedelta
+from service.intervals import IntervalTree
+
+
+######################################################################
+#  I N T E R V A L   T R E E   T E S T   C A S E S
+######################################################################
+
+
+class TestIntervalTree(unittest.TestCase):
+    """ Test Cases for IntervalTree """
+
+    def test_point_queries(self):
+        """ Find the intervals that contain a point """
+        tree = IntervalTree([(1, 0, 10), (2, 5, 15), (3, 20, 30)])
+        self.assertEqual(sorted(tree.at(7)), [1, 2])
+        self.assertEqual(sorted(tree.at(10)), [1, 2])
+        self.assertEqual(sorted(tree.at(17)), [])
+        self.assertEqual(sorted(tree.at(20)), [3])
+        self.assertEqual(len(tree), 3)
+
+    def test_window_queries(self):
+        """ Find the intervals that overlap a window """
+        tree = IntervalTree([(1, 0, 10), (2, 5, 15), (3, 20, 30)])
+        self.assertEqual(sorted(tree.overlapping(12, 19)), [2])
+        self.assertEqual(sorted(tree.overlapping(15, 20)), [2, 3])
+        self.assertEqual(sorted(tree.overlapping(31, 40)), [])
+        self.assertRaises(ValueError, tree.overlapping, 5, 1)
+
+    def test_add_and_remove(self):
+        """ Keep the tree up to date incrementally """
+        tree = IntervalTree()
+        self.assertEqual(tree.at(1), [])
+        tree.add(1, 0, 10)
+        tree.add(2, 50, 60)
+        self.assertEqual(tree.at(55), [2])
+        tree.add(2, 5, 8)  # move an interval
+        self.assertEqual(tree.at(55), [])
+        self.assertEqual(sorted(tree.at(6)), [1, 2])
+        tree.remove(1)
+        tree.remove(99)
+        self.assertEqual(tree.at(6), [2])
+        self.assertNotIn(1, tree)
+        self.assertRaises(ValueError, tree.add, 3, 10, 0)
+
+    def test_datetimes(self):
+        """ Index datetime intervals """
+        start = datetime(2021, 1, 1)
+        tree = IntervalTree([(1, start, start + timedelta(days=30))])
+        tree.add(2, start + timedelta(days=20), start + timedelta(days=40))
+        self.assertEqual(sorted(tree.at(start + timedelta(days=25))), [1, 2])
+        self.assertEqual(tree.at(start + timedelta(days=35)), [2])
+
+    def test_matches_brute_force(self):
+        """ Agree with a linear scan on random intervals """
+        rng = random.Random(42)
+        intervals = {}
+        for key in range(200):
+            start = rng.randint(0, 1000)
+            intervals[key] = (start, start + rng.randint(0, 100))
+        tree = IntervalTree((key, start, end) for key, (start, end) in intervals.items())
+        for key in range(200, 300):
+            start = rng.randint(0, 1000)
+            intervals[key] = (start, start + rng.randint(0, 300))
+            tree.add(key, *intervals[key])
+        for key in rng.sample(sorted(intervals), 100):
+            del intervals[key]
+            tree.remove(key)
+        for _ in range(200):
+            point = rng.randint(-10, 1400)
+            expected = sorted(k for k, (s, e) in intervals.items() if s <= point <= e)
+            self.assertEqual(sorted(tree.at(point)), expected)
+            low = rng.randint(-10, 1400)
+            high = low + rng.randint(0, 50)
+            expected = sorted(k for k, (s, e) in intervals.items() if s <= high and e >= low)
+            self.assertEqual(sorted(tree.overlapping(low, high)), expected)
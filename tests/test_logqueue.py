@@ -0,0 +1,151 @@
+"""
+Test cases for the queued logging
+Test cases can be run with:
+    nosetests
+    coverage report -m
+While debugging just these tests it's convinient to use this:
+    nosetests --stop tests/test_logqueue.py:TestQueueLogging
+"""
+import json
+import queue
+import logging
+import unittest
+from service.logqueue import BoundedQueueHandler, JsonFormatter, QueueLogging
+
+
+class ListHandler(logging.Handler):
+    """ Keeps the formatted records """
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def make_record(level, message="hello %s", args=("world",)):
+    return logging.LogRecord("test", level, __file__, 1, message, args, None)
+
+
+######################################################################
+#  B O U N D E D   Q U E U E   H A N D L E R   T E S T   C A S E S
+######################################################################
+
+
+class TestBoundedQueueHandler(unittest.TestCase):
+    """ Test Cases for the shedding policy """
+
+    def setUp(self):
+        self.queue = queue.Queue(10)
+        self.handler = BoundedQueueHandler(self.queue, sample_rate=2)
+
+    def fill(self, count):
+        for _ in range(count):
+            self.queue.put_nowait(make_record(logging.INFO))
+
+    def test_queues_records(self):
+        """ Queue records with their message formatted """
+        self.handler.handle(make_record(logging.INFO))
+        record = self.queue.get_nowait()
+        self.assertEqual(record.getMessage(), "hello world")
+        self.assertEqual(self.handler.dropped, 0)
+
+    def test_samples_info(self):
+        """ Keep one in sample_rate info records above half full """
+        self.fill(5)
+        for _ in range(4):
+            self.handler.handle(make_record(logging.INFO))
+        records = [self.queue.get_nowait() for _ in range(self.queue.qsize())][5:]
+        self.assertEqual([record.levelno for record in records], [logging.INFO, logging.WARNING] * 2)
+        self.assertEqual(self.handler.dropped_total, 2)
+
+    def test_drops_info_near_full(self):
+        """ Keep the last tenth of the queue for warnings """
+        self.fill(9)
+        self.handler.handle(make_record(logging.INFO))
+        self.assertEqual(self.queue.qsize(), 9)
+        self.handler.handle(make_record(logging.ERROR, "failed", ()))
+        self.assertEqual(self.queue.qsize(), 10)
+        self.assertEqual(self.handler.dropped_total, 1)
+
+    def test_unbounded(self):
+        """ Keep every record when the queue has no maxsize """
+        handler = BoundedQueueHandler(queue.Queue(0), sample_rate=2)
+        for level in (logging.DEBUG, logging.INFO, logging.WARNING):
+            handler.handle(make_record(level))
+        self.assertEqual(handler.queue.qsize(), 3)
+        self.assertEqual(handler.dropped_total, 0)
+
+    def test_never_blocks(self):
+        """ Drop warnings too rather than wait on a full queue """
+        self.fill(10)
+        self.handler.handle(make_record(logging.ERROR, "failed", ()))
+        self.assertEqual(self.handler.dropped, 1)
+
+    def test_reports_dropped(self):
+        """ Log how many records were dropped once there is room """
+        self.fill(10)
+        self.handler.handle(make_record(logging.WARNING, "lost", ()))
+        self.handler.handle(make_record(logging.WARNING, "lost", ()))
+        for _ in range(10):
+            self.queue.get_nowait()
+        self.handler.handle(make_record(logging.WARNING, "kept", ()))
+        messages = [self.queue.get_nowait().getMessage() for _ in range(2)]
+        self.assertEqual(messages, ["kept", "Log queue full, 2 log records were dropped"])
+        self.assertEqual(self.handler.dropped, 0)
+        self.assertEqual(self.handler.dropped_total, 2)
+
+
+######################################################################
+#  Q U E U E   L O G G I N G   T E S T   C A S E S
+######################################################################
+
+
+class TestQueueLogging(unittest.TestCase):
+    """ Test Cases for the listener and the JSON output """
+
+    def setUp(self):
+        self.logger = logging.getLogger("test.logqueue")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.output = ListHandler()
+        self.logging = QueueLogging([self.logger], [self.output], maxsize=100)
+
+    def tearDown(self):
+        self.logging.stop()
+        self.logger.handlers = []
+
+    def test_writes_in_background(self):
+        """ Pass the queued records to the handlers """
+        self.logging.start()
+        self.assertIsInstance(self.logger.handlers[0], BoundedQueueHandler)
+        self.logger.info("Processing lookup for id %s ...", 42)
+        self.logging.stop()
+        self.assertEqual(self.output.lines, ["Processing lookup for id 42 ..."])
+        self.assertEqual(self.logging.stats(), {"queued": 0, "dropped": 0})
+
+    def test_restart(self):
+        """ Start a new listener, as after a fork """
+        self.logging.start()
+        self.logging.stop()  # a forked process has no listener thread
+        self.logging.restart()
+        self.logger.info("after the fork")
+        self.logging.stop()
+        self.assertEqual(self.output.lines, ["after the fork"])
+
+    def test_json(self):
+        """ Write one JSON object per record """
+        self.output.setFormatter(JsonFormatter())
+        self.logging.start()
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            self.logger.exception("Failed %s", "twice")
+        self.logging.stop()
+        document = json.loads(self.output.lines[0])
+        self.assertEqual(document["level"], "ERROR")
+        self.assertEqual(document["logger"], "test.logqueue")
+        self.assertTrue(document["message"].startswith("Failed twice"))
+        self.assertIn("ValueError: bad", document["message"])
+        self.assertIn("time", document)
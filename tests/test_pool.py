@@ -0,0 +1,56 @@
+"""
+Test cases for the timed connection pool
+Test cases can be run with:
+    nosetests
+    coverage report -m
+While debugging just these tests it's convinient to use this:
+    nosetests --stop tests/test_pool.py:TestTimedQueuePool
+"""
+import sqlite3
+import unittest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from service.pool import TimedQueuePool
+
+
+######################################################################
+#  T I M E D   Q U E U E   P O O L   T E S T   C A S E S
+######################################################################
+
+
+class TestTimedQueuePool(unittest.TestCase):
+    """ Test Cases for TimedQueuePool """
+
+    def setUp(self):
+        self.pool = TimedQueuePool(
+            lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=0.05
+        )
+
+    def tearDown(self):
+        self.pool.dispose()
+
+    def test_counts_checkouts(self):
+        """ Count every checkout and its wait """
+        for _ in range(3):
+            self.pool.connect().close()
+        stats = self.pool.stats()
+        self.assertEqual(stats["checkouts"], 3)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertGreaterEqual(stats["wait_max"], stats["wait_avg"])
+
+    def test_records_wait_on_timeout(self):
+        """ Record the wait of a checkout that timed out """
+        self.pool.slow_checkout = 0.01
+        connection = self.pool.connect()
+        with self.assertLogs("flask.app", level="WARNING"):
+            self.assertRaises(PoolTimeoutError, self.pool.connect)
+        connection.close()
+        self.assertGreaterEqual(self.pool.stats()["wait_max"], 0.05)
+
+    def test_recreate(self):
+        """ Keep the settings when the pool is recreated """
+        self.pool.slow_checkout = 0.5
+        pool = self.pool.recreate()
+        self.assertIsInstance(pool, TimedQueuePool)
+        self.assertEqual(pool.slow_checkout, 0.5)
+        self.assertEqual(pool.size(), 1)
+        self.assertEqual(pool.stats()["checkouts"], 0)
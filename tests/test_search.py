@@ -0,0 +1,98 @@
+"""
+Test cases for the in-memory search index
+Test cases can be run with:
+    nosetests
+    coverage report -m
+While debugging just these tests it's convinient to use this:
+    nosetests --stop tests/test_search.py:TestNgramIndex
+"""
+import random
+import unittest
+from service.search import NgramIndex, trigrams, words
+
+
+######################################################################
+#  N G R A M   I N D E X   T E S T   C A S E S
+######################################################################
+
+
+class TestNgramIndex(unittest.TestCase):
+    """ Test Cases for NgramIndex """
+
+    def setUp(self):
+        self.index = NgramIndex([
+            (1, "Christmas Sale", "20%OFF"),
+            (2, "Summer Sale", "BOGO"),
+            (3, "Black Friday", "buy 1 get 1 free"),
+            (4, "Christmas Sale", "10%OFF"),
+        ])
+
+    def keys(self, query, **kwargs):
+        return [key for _, key in self.index.search(query, **kwargs)]
+
+    def test_words_and_trigrams(self):
+        """ Split texts the way pg_trgm does """
+        self.assertEqual(words("Buy 1, get_1 FREE!"), ["buy", "1", "get", "1", "free"])
+        self.assertEqual(trigrams("cat"), {"  c", " ca", "cat", "at "})
+
+    def test_prefixes(self):
+        """ Match words that start with the query """
+        self.assertEqual(self.index.search("chr"), [(1.0, 1), (1.0, 4)])
+        self.assertEqual(self.keys("black fri"), [3])
+        self.assertEqual(self.keys("bog"), [2])
+        self.assertEqual(self.keys("20%"), [1])
+
+    def test_typos(self):
+        """ Match words that share most of their trigrams """
+        results = self.index.search("chrismas")
+        self.assertEqual([key for _, key in results], [1, 4])
+        self.assertTrue(0.6 <= results[0][0] < 1.0)
+        self.assertEqual(self.keys("sumer sale"), [2])  # "sale" alone is too little
+        self.assertEqual(self.keys("winter"), [])
+        self.assertEqual(self.keys("chrismas", threshold=0.9), [])
+
+    def test_limit(self):
+        """ Return the best matches first, then the lowest keys """
+        self.assertEqual(self.keys("sale", limit=2), [1, 2])
+        self.assertEqual(self.keys("sale", limit=3), [1, 2, 4])
+        self.assertEqual(self.keys(""), [])
+
+    def test_limit_skips_returned_keys(self):
+        """ Fill the limit even when better texts already returned many keys """
+        index = NgramIndex([(key, "sale", "salt {}".format(name)) for key, name in enumerate("abcd", 1)])
+        index.add(5, "salt")
+        index.add(6, "salt")
+        self.assertEqual([key for _, key in index.search("sale", limit=6)], [1, 2, 3, 4, 5, 6])
+
+    def test_add_and_remove(self):
+        """ Keep the index up to date incrementally """
+        self.index.add(5, "Winter Sale", "5%OFF")
+        self.assertEqual(self.keys("wintr"), [5])
+        self.index.add(5, "Spring Sale", "5%OFF")  # rename
+        self.assertEqual(self.keys("wintr"), [])
+        self.assertEqual(self.keys("spring"), [5])
+        self.index.remove(1)
+        self.index.remove(4)
+        self.index.remove(99)
+        self.assertEqual(self.keys("christmas"), [])
+        self.assertNotIn(1, self.index)
+        self.assertEqual(len(self.index), 3)
+
+    def test_matches_brute_force(self):
+        """ Agree with scoring every document on random texts """
+        rng = random.Random(42)
+        vocabulary = ["summer", "sale", "christmas", "black", "friday", "deals", "spring", "bogo"]
+        documents = {}
+        index = NgramIndex()
+        for key in range(300):
+            documents[key] = " ".join(rng.sample(vocabulary, rng.randint(1, 3)))
+            index.add(key, documents[key])
+        for key in rng.sample(sorted(documents), 100):
+            del documents[key]
+            index.remove(key)
+        for query in ("sumer", "chrstmas sal", "fri", "blak deals", "bogo spring"):
+            expected = sorted(
+                (-score, key) for key, text in documents.items()
+                for score in [NgramIndex([(key, text)]).scores(query).get(text, 0)] if score
+            )
+            self.assertEqual(index.search(query, limit=20), [(-score, key) for score, key in expected[:20]])
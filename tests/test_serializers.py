@@ -0,0 +1,99 @@
+"""
+Test cases for the Promotion serializers
+Test cases can be run with:
+    nosetests
+    coverage report -m
+While debugging just these tests it's convinient to use this:
+    nosetests --stop tests/test_serializers.py:TestPromotionSerializer
+"""
+import json
+import unittest
+from datetime import datetime
+from service import app
+from service.routes import api, promotion_model
+from service.models import Promotion
+from service.serializers import CsvSerializer, PromotionSerializer, JSON_BACKENDS, json_backend
+
+
+######################################################################
+#  P R O M O T I O N   S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+
+
+class TestPromotionSerializer(unittest.TestCase):
+    """ Test Cases for PromotionSerializer """
+
+    def setUp(self):
+        self.promotions = [
+            Promotion(
+                id=i,
+                title="Promo {}".format(i),
+                promotion_type="Discount",
+                start_date=datetime(2021, 6, i, 9, 30),
+                end_date=datetime(2021, 7, i),
+                active=bool(i % 2),
+            )
+            for i in range(1, 4)
+        ]
+
+    def marshalled(self):
+        with app.app_context():
+            return json.loads(json.dumps(
+                api.marshal([p.serialize() for p in self.promotions], promotion_model)
+            ))
+
+    def test_matches_marshal(self):
+        """ Serialize the same documents as marshal() for every backend """
+        for name in JSON_BACKENDS:
+            serializer = PromotionSerializer(dumps=json_backend(name))
+            self.assertEqual(json.loads(serializer.many(self.promotions)), self.marshalled())
+
+    def test_one_and_lines(self):
+        """ Serialize one Promotion and newline delimited Promotions """
+        serializer = PromotionSerializer(dumps=json_backend("json"))
+        expected = self.marshalled()
+        self.assertEqual(json.loads(serializer.one(self.promotions[0])), expected[0])
+        lines = serializer.lines(self.promotions).decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+        self.assertEqual(serializer.lines([]), b"")
+
+    def test_field_subset(self):
+        """ Serialize only the requested fields """
+        serializer = PromotionSerializer(fields=("id", "end_date"), dumps=json_backend("json"))
+        self.assertEqual(
+            json.loads(serializer.one(self.promotions[0])),
+            {"id": 1, "end_date": "2021-07-01T00:00:00"},
+        )
+
+    def test_positional(self):
+        """ Serialize tuples holding the fields in order """
+        rows = [tuple(getattr(p, name) for name in ("id", "start_date")) for p in self.promotions]
+        serializer = PromotionSerializer(("id", "start_date"), dumps=json_backend("json"), positional=True)
+        self.assertEqual(json.loads(serializer.one(rows[1])), {"id": 2, "start_date": "2021-06-02T09:30:00"})
+
+    def test_csv(self):
+        """ Write a header and one CSV line per Promotion """
+        serializer = CsvSerializer()
+        self.assertEqual(serializer.header(), b"id,title,promotion_type,start_date,end_date,active\r\n")
+        lines = serializer.lines(self.promotions).decode("utf-8").splitlines()
+        self.assertEqual(lines[0], "1,Promo 1,Discount,2021-06-01T09:30:00,2021-07-01T00:00:00,true")
+        self.assertEqual(lines[1].split(",")[-1], "false")
+        self.assertEqual(len(lines), 3)
+
+    def test_csv_quoting(self):
+        """ Quote values holding commas, quotes and line breaks """
+        serializer = CsvSerializer(("id", "title"), positional=True)
+        self.assertEqual(
+            serializer.lines([(1, 'Buy 1, get "1"'), (2, "two\nlines")]),
+            b'1,"Buy 1, get ""1"""\r\n2,"two\nlines"\r\n',
+        )
+        self.assertEqual(serializer.lines([]), b"")
+
+    def test_invalid_field(self):
+        """ Reject field names that are not identifiers """
+        self.assertRaises(ValueError, PromotionSerializer, fields=("id); import os",))
+
+    def test_unknown_backend(self):
+        """ Reject an unknown JSON backend """
+        self.assertRaises(ValueError, json_backend, "pickle")
+        self.assertIn(json_backend(), JSON_BACKENDS.values())
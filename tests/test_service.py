@@ -8,13 +8,17 @@ Test cases can be run with the following:
     nosetests --stop tests/test_service.py:TestPromotionServer
 """
 
+import io
 import os
+import csv
+import gzip
 import json
 import logging
 import unittest
+from unittest.mock import patch
 from urllib.parse import quote_plus
 from service import status  # HTTP Status Codes
-from service.models import db
+from service.models import db, Promotion
 from service.routes import app, init_db
 from .factories import PromotionFactory
 from dateutil import parser
@@ -49,17 +53,21 @@ class TestPromotionServer(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        # fail any test whose request runs more SQL than its route's budget
+        app.config["QUERY_BUDGET_STRICT"] = True
         app.logger.setLevel(logging.CRITICAL)
         init_db()
 
     @classmethod
     def tearDownClass(cls):
-        pass
+        app.config["QUERY_BUDGET_STRICT"] = False
 
     def setUp(self):
         """ Runs before each test """
         db.drop_all()  # clean up the last tests
         db.create_all()  # create new tables
+        Promotion.invalidate_intervals()
+        Promotion.invalidate_search()
         self.app = app.test_client()
 
     def tearDown(self):
@@ -272,6 +280,35 @@ class TestPromotionServer(unittest.TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_session_removed_after_request(self):
+        """Give every request a database session of its own"""
+        session = db.session()
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIsNot(db.session(), session)
+
+    def test_delete_stale_cached_promotion(self):
+        """Delete a Promotion whose cached copy is stale"""
+        app.config["PROMOTION_CACHE_ENABLED"] = True
+        Promotion.init_db(app)
+        self.addCleanup(Promotion.init_db, app)
+        self.addCleanup(app.config.update, PROMOTION_CACHE_ENABLED=False)
+        promotion_id = self._create_promotions(1)[0].id
+        resp = self.app.get("{0}/{1}".format(BASE_URL, promotion_id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # another worker changes the row, the cache still has version 1
+        db.session.execute("UPDATE promotion SET version = version + 1")
+        db.session.commit()
+        db.session.remove()
+        resp = self.app.delete("{0}/{1}".format(BASE_URL, promotion_id))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.get("{0}/{1}".format(BASE_URL, promotion_id))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        # deleting it again, and the next request, still work
+        resp = self.app.delete("{0}/{1}".format(BASE_URL, promotion_id))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self._create_promotions(1)
+
     def test_query_promotion_list_by_promotion_type(self):
         """Query Promotions by promotion_type"""
         promotions = self._create_promotions(10)
@@ -334,3 +371,458 @@ class TestPromotionServer(unittest.TestCase):
             self.assertEqual(parser.parse(promotion["end_date"]).
                             strftime('%Y-%m-%d'),
                              test_end_date)
+
+    def test_get_promotion_list_paged(self):
+        """ Page through the Promotions with a cursor """
+        promotions = self._create_promotions(5)
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([p["id"] for p in data], [p.id for p in promotions[:2]])
+        self.assertIn('rel="next"', resp.headers.get("Link"))
+        seen = [p["id"] for p in data]
+        while "X-Next-Cursor" in resp.headers:
+            resp = self.app.get(
+                BASE_URL, query_string="limit=2&cursor={}".format(resp.headers["X-Next-Cursor"])
+            )
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(p["id"] for p in resp.get_json())
+        self.assertEqual(seen, [p.id for p in promotions])
+        self.assertIsNone(resp.headers.get("Link"))
+
+    def test_get_promotion_list_paged_by_end_date(self):
+        """ Page through the Promotions by end date """
+        self._create_promotions(6)
+        seen = []
+        query_string = "limit=4&sort=end_date"
+        while query_string:
+            resp = self.app.get(BASE_URL, query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend((p["end_date"], p["id"]) for p in resp.get_json())
+            cursor = resp.headers.get("X-Next-Cursor")
+            query_string = "limit=4&cursor={}".format(cursor) if cursor else None
+        self.assertEqual(len(seen), 6)
+        self.assertEqual(seen, sorted(seen))
+
+    def test_get_promotion_list_bad_cursor(self):
+        """ Page through the Promotions with a bad cursor """
+        resp = self.app.get(BASE_URL, query_string="cursor=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_promotion_list(self):
+        """ Stream the Promotions as NDJSON """
+        promotions = self._create_promotions(5)
+        resp = self.app.get(BASE_URL, query_string="stream=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        data = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([p["id"] for p in data], [p.id for p in promotions])
+        self.assertEqual(data[0]["title"], promotions[0].title)
+        self.assertEqual(
+            parser.parse(data[0]["end_date"]).strftime('%Y-%m-%d'), promotions[0].end_date
+        )
+
+    def test_stream_promotion_list_by_accept(self):
+        """ Stream the Promotions when the client accepts NDJSON """
+        promotions = self._create_promotions(3)
+        test_active = promotions[0].active
+        resp = self.app.get(
+            BASE_URL,
+            query_string="active={}".format(test_active),
+            headers={"Accept": "application/x-ndjson"},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        data = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(data), len([p for p in promotions if p.active == test_active]))
+        for promotion in data:
+            self.assertEqual(promotion["active"], test_active)
+
+    def test_export_csv(self):
+        """ Export the Promotions as CSV """
+        promotions = self._create_promotions(3)
+        resp = self.app.get(BASE_URL + "/export", query_string="format=csv")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "text/csv")
+        self.assertIn('filename="promotions.csv"', resp.headers["Content-Disposition"])
+        rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+        self.assertEqual([int(row["id"]) for row in rows], [p.id for p in promotions])
+        self.assertEqual(rows[0]["title"], promotions[0].title)
+        self.assertEqual(rows[0]["active"], "true" if promotions[0].active else "false")
+        self.assertEqual(parser.parse(rows[0]["end_date"]).strftime('%Y-%m-%d'), promotions[0].end_date)
+
+    def test_export_ndjson_gzip(self):
+        """ Export the matching Promotions as compressed NDJSON """
+        promotions = self._create_promotions(4)
+        test_active = promotions[0].active
+        resp = self.app.get(
+            BASE_URL + "/export",
+            query_string="format=ndjson&compress=gzip&fields=id,active&active={}".format(test_active),
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        lines = gzip.decompress(resp.get_data()).decode("utf-8").splitlines()
+        data = [json.loads(line) for line in lines]
+        expected = [p.id for p in promotions if p.active == test_active]
+        self.assertEqual([promotion["id"] for promotion in data], expected)
+        self.assertEqual(set(data[0]), {"id", "active"})
+
+    def test_export_bad_request(self):
+        """ Reject unknown export formats and compressions """
+        resp = self.app.get(BASE_URL + "/export", query_string="format=xml")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL + "/export", query_string="compress=zip")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_promotion_list_fields(self):
+        """ List only the requested fields of the Promotions """
+        promotions = self._create_promotions(3)
+        resp = self.app.get(BASE_URL, query_string="fields=id,title,active")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 3)
+        for promotion in data:
+            self.assertEqual(set(promotion), {"id", "title", "active"})
+        self.assertEqual(data[0]["title"], promotions[0].title)
+
+    def test_get_promotion_list_fields_paged(self):
+        """ Page and stream through only the requested fields """
+        promotions = self._create_promotions(5)
+        seen = []
+        query_string = "fields=title&limit=2&sort=end_date"
+        while query_string:
+            resp = self.app.get(BASE_URL, query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            for promotion in resp.get_json():
+                self.assertEqual(set(promotion), {"title"})
+                seen.append(promotion["title"])
+            cursor = resp.headers.get("X-Next-Cursor")
+            query_string = "fields=title&limit=2&cursor={}".format(cursor) if cursor else None
+        self.assertEqual(sorted(seen), sorted(p.title for p in promotions))
+        resp = self.app.get(BASE_URL, query_string="fields=id&stream=true")
+        data = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(data, [{"id": p.id} for p in promotions])
+
+    def test_get_promotion_list_bad_fields(self):
+        """ List Promotions with an unknown field """
+        resp = self.app.get(BASE_URL, query_string="fields=id,secret")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_promotion_fields(self):
+        """ Get only the requested fields of a Promotion """
+        test_promotion = self._create_promotions(1)[0]
+        resp = self.app.get(
+            "/promotions/{}".format(test_promotion.id), query_string="fields=title,active"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            resp.get_json(), {"title": test_promotion.title, "active": test_promotion.active}
+        )
+        # projections share the version but get a weak ETag
+        etag = self.app.get("/promotions/{}".format(test_promotion.id)).headers["ETag"]
+        self.assertEqual(resp.headers["ETag"], "W/" + etag)
+        resp = self.app.get(
+            "/promotions/{}".format(test_promotion.id), query_string="fields=title,active",
+            headers={"If-None-Match": "W/" + etag},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.app.get("/promotions/0", query_string="fields=title")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_count_promotions(self):
+        """ Count the Promotions matching a filter """
+        promotions = self._create_promotions(6)
+        test_active = promotions[0].active
+        expected = len([p for p in promotions if p.active == test_active])
+        resp = self.app.get(BASE_URL + "/count", query_string="active={}".format(test_active))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"count": expected, "estimated": False})
+        self.assertEqual(resp.headers["X-Total-Count"], str(expected))
+        resp = self.app.head(BASE_URL, query_string="active={}".format(test_active))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["X-Total-Count"], str(expected))
+        self.assertEqual(resp.data, b"")
+
+    def test_count_promotions_estimate(self):
+        """ Estimate the count of a large table """
+        self._create_promotions(2)
+        resp = self.app.get(BASE_URL + "/count", query_string="total=estimate")
+        self.assertEqual(resp.get_json(), {"count": 2, "estimated": False})
+        app.config["COUNT_ESTIMATE_THRESHOLD"] = 0
+        try:
+            resp = self.app.get(BASE_URL + "/count", query_string="total=estimate")
+        finally:
+            app.config["COUNT_ESTIMATE_THRESHOLD"] = 100000
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.get_json()["estimated"])
+        resp = self.app.get(BASE_URL + "/count", query_string="total=guess")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_promotion_list_total(self):
+        """ Page through the Promotions with their total count """
+        self._create_promotions(5)
+        resp = self.app.get(BASE_URL, query_string="limit=2&total=exact")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertEqual(resp.headers["X-Total-Count"], "5")
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertNotIn("X-Total-Count", resp.headers)
+
+    def test_query_promotion_list_by_several_filters(self):
+        """Query Promotions by more than one filter"""
+        promotions = self._create_promotions(10)
+        test_type = promotions[0].promotion_type
+        test_active = promotions[0].active
+        matching = [
+            promotion for promotion in promotions
+            if promotion.promotion_type == test_type and promotion.active == test_active
+        ]
+        resp = self.app.get(
+            BASE_URL,
+            query_string="promotion_type={}&active={}".format(quote_plus(test_type), test_active),
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), len(matching))
+        for promotion in data:
+            self.assertEqual(promotion["promotion_type"], test_type)
+            self.assertEqual(promotion["active"], test_active)
+
+    def test_query_promotion_list_by_date_range(self):
+        """Query Promotions by a date range and by the day they run on"""
+        promotions = self._create_promotions(10)
+        ending = [promotion for promotion in promotions if promotion.end_date < "2022-07-01"]
+        resp = self.app.get(BASE_URL, query_string="end_date_lt=2022-07-01")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), len(ending))
+        running = [
+            promotion for promotion in promotions
+            if promotion.start_date <= "2021-11-15" <= promotion.end_date
+        ]
+        resp = self.app.get(BASE_URL, query_string="active_on=2021-11-15")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), len(running))
+
+    def test_bulk_create_promotions(self):
+        """ Create many Promotions in one request """
+        payload = [PromotionFactory().serialize() for _ in range(5)]
+        resp = self.app.post(BASE_URL + "/bulk", json=payload, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(len(data["ids"]), 5)
+        self.assertEqual(data["errors"], [])
+        resp = self.app.get("{}/{}".format(BASE_URL, data["ids"][2]))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["title"], payload[2]["title"])
+
+    def test_bulk_create_promotions_in_batches(self):
+        """ Create many Promotions with one INSERT per batch """
+        app.config["BULK_BATCH_SIZE"] = 2
+        self.addCleanup(app.config.update, BULK_BATCH_SIZE=1000)
+        payload = [PromotionFactory().serialize() for _ in range(5)]
+        resp = self.app.post(BASE_URL + "/bulk", json=payload, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertIn('desc="3 queries"', resp.headers["Server-Timing"])
+        # a batch the database rejects is retried row by row
+        payload[3]["title"] = "x" * 1000
+        resp = self.app.post(BASE_URL + "/bulk", json=payload, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([error["index"] for error in resp.get_json()["errors"]], [3])
+
+    def test_bulk_create_promotions_partial(self):
+        """ Create many Promotions when some of them are not valid """
+        payload = [PromotionFactory().serialize() for _ in range(5)]
+        del payload[1]["title"]
+        payload[3]["start_date"] = "not a date"
+        payload[4]["active"] = "false"
+        body = "\n".join(json.dumps(item) for item in payload) + "\n{bad json\n"
+        resp = self.app.post(BASE_URL + "/bulk", data=body, content_type="application/x-ndjson")
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        data = resp.get_json()
+        self.assertEqual(len(data["ids"]), 2)
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 3, 4, 5])
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 2)
+
+    def test_bulk_create_promotions_bad_body(self):
+        """ Create many Promotions with a body that is not a list """
+        resp = self.app.post(BASE_URL + "/bulk", json={}, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(BASE_URL + "/bulk", data="[]", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_bulk_activate_and_deactivate(self):
+        """ Activate and deactivate Promotions by filter """
+        promotions = self._create_promotions(10)
+        test_type = promotions[0].promotion_type
+        matching = [p for p in promotions if p.promotion_type == test_type]
+        resp = self.app.put(
+            BASE_URL + "/activate", query_string="promotion_type={}".format(quote_plus(test_type))
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["count"], len([p for p in matching if not p.active]))
+        resp = self.app.get(
+            BASE_URL, query_string="promotion_type={}&active=false".format(quote_plus(test_type))
+        )
+        self.assertEqual(resp.get_json(), [])
+        resp = self.app.put(
+            BASE_URL + "/deactivate", query_string="promotion_type={}".format(quote_plus(test_type))
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["count"], len(matching))
+
+    def test_bulk_activate_without_filter(self):
+        """ Activate Promotions without a filter """
+        resp = self.app.put(BASE_URL + "/activate")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.delete(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_delete_by_ids(self):
+        """ Delete Promotions by a list of ids """
+        promotions = self._create_promotions(4)
+        ids = "{},{}".format(promotions[0].id, promotions[3].id)
+        resp = self.app.delete(BASE_URL, query_string="ids={}".format(ids))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["count"], 2)
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(
+            sorted(p["id"] for p in resp.get_json()), [promotions[1].id, promotions[2].id]
+        )
+        resp = self.app.delete(BASE_URL, query_string="ids=1,x")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_effective_promotions(self):
+        """ Get the Promotions in effect at a moment """
+        promotions = self._create_promotions(10)
+        running = [p for p in promotions if p.start_date <= "2021-11-15" <= p.end_date]
+        resp = self.app.get(BASE_URL + "/effective", query_string="at=2021-11-15T00:00:00")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(p["id"] for p in resp.get_json()), sorted(p.id for p in running))
+        # the index follows deletes made through the service
+        if running:
+            self.app.delete("{}/{}".format(BASE_URL, running[0].id))
+            resp = self.app.get(BASE_URL + "/effective", query_string="at=2021-11-15")
+            self.assertEqual(len(resp.get_json()), len(running) - 1)
+
+    def test_get_effective_promotions_in_window(self):
+        """ Get the Promotions in effect during a window """
+        promotions = self._create_promotions(10)
+        overlapping = [p for p in promotions if p.start_date <= "2021-07-15" and p.end_date >= "2021-06-01"]
+        resp = self.app.get(BASE_URL + "/effective", query_string="from=2021-06-01&to=2021-07-15")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(p["id"] for p in resp.get_json()), sorted(p.id for p in overlapping))
+        resp = self.app.get(BASE_URL + "/effective", query_string="from=2021-06-01")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL + "/effective", query_string="from=2021-08-01&to=2021-06-01")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_promotions(self):
+        """ Search the Promotions by title and type """
+        promotions = self._create_promotions(5)
+        promotions[0].title = "Hanukkah Deals"
+        self.app.put("{}/{}".format(BASE_URL, promotions[0].id), json=promotions[0].serialize(),
+                     content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get(BASE_URL + "/search", query_string="q=hanukah")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data[0]["id"], promotions[0].id)
+        self.assertEqual(data[0]["title"], "Hanukkah Deals")
+        self.assertGreater(data[0]["score"], 0.6)
+        self.assertLess(data[0]["score"], 1)
+        resp = self.app.get(BASE_URL + "/search", query_string="q=hanuk")
+        self.assertEqual(resp.get_json()[0]["score"], 1)
+        resp = self.app.get(BASE_URL + "/search", query_string="q=hanukkah&limit=1000")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL + "/search")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_promotion_not_modified(self):
+        """ Get a Promotion with a matching If-None-Match """
+        test_promotion = self._create_promotions(1)[0]
+        url = "{}/{}".format(BASE_URL, test_promotion.id)
+        resp = self.app.get(url)
+        etag = resp.headers.get("ETag")
+        self.assertEqual(etag, '"{}-1"'.format(test_promotion.id))
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+        # an update changes the ETag
+        data = test_promotion.serialize()
+        data["title"] = "changed"
+        resp = self.app.put(url, json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.headers.get("ETag"), '"{}-2"'.format(test_promotion.id))
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_get_promotion_list_not_modified(self):
+        """ Get the list of Promotions with a matching If-None-Match """
+        promotions = self._create_promotions(3)
+        resp = self.app.get(BASE_URL)
+        etag = resp.headers.get("ETag")
+        self.assertIsNotNone(etag)
+        resp = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        # filters get their own ETag
+        resp = self.app.get(BASE_URL, query_string="active=true", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # and so do pages, tagged by the rows on them
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        page_etag = resp.headers.get("ETag")
+        self.assertNotEqual(page_etag, etag)
+        resp = self.app.get(BASE_URL, query_string="limit=2", headers={"If-None-Match": page_etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn("X-Next-Cursor", resp.headers)
+        # and any change to a row changes it
+        self.app.put("{}/{}/activate".format(BASE_URL, promotions[0].id))
+        self.app.put("{}/{}/deactivate".format(BASE_URL, promotions[0].id))
+        resp = self.app.delete("{}/{}".format(BASE_URL, promotions[1].id))
+        resp = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+
+    def test_update_promotion_if_match(self):
+        """ Update a Promotion with If-Match """
+        test_promotion = self._create_promotions(1)[0]
+        url = "{}/{}".format(BASE_URL, test_promotion.id)
+        etag = self.app.get(url).headers["ETag"]
+        data = test_promotion.serialize()
+        data["title"] = "first"
+        resp = self.app.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["title"], "first")
+        self.assertEqual(resp.headers["ETag"], '"{}-2"'.format(test_promotion.id))
+        # the old version no longer matches
+        data["title"] = "second"
+        resp = self.app.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put(url, json=data, headers={"If-Match": '"0-1"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put(url + "0", json=data, headers={"If-Match": '"{}0-1"'.format(test_promotion.id)})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get(url)
+        self.assertEqual(resp.get_json()["title"], "first")
+
+    def test_activate_promotion_without_returning(self):
+        """ Activate a Promotion on a database without UPDATE ... RETURNING """
+        test_promotion = self._create_promotions(1)[0]
+        with patch.object(db.engine.dialect, "name", "sqlite"):
+            resp = self.app.put("{}/{}/activate".format(BASE_URL, test_promotion.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn('desc="2 queries"', resp.headers["Server-Timing"])
+        self.assertEqual(resp.get_json()["active"], True)
+
+    def test_activate_promotion_persists(self):
+        """ Activate and deactivate a Promotion and read it back """
+        test_promotion = self._create_promotions(1)[0]
+        url = "{}/{}".format(BASE_URL, test_promotion.id)
+        resp = self.app.put(url + "/activate")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["ETag"], self.app.get(url).headers["ETag"])
+        self.assertEqual(self.app.get(url).get_json()["active"], True)
+        resp = self.app.put(url + "/deactivate")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.app.get(url).get_json()["active"], False)
+        resp = self.app.put(BASE_URL + "/abc/activate")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)